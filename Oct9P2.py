@@ -1,40 +1,250 @@
 import dash
+import flask
+import functools
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
 from dash import dcc, html, Input, Output
 import dash_bootstrap_components as dbc
-import plotly.express as px
-import pandas as pd
+import plotly.io as pio
+import numpy as np
 from dash import dcc, html, Input, Output, State
+import compression
+import figures
+import geometry
+import metrics
+import prerender
+import singleflight
+from metrics import phase
+from dataset import DatasetManager, density_levels, load_dataset, national
 
 
 # =========================
 # Load Data
 # =========================
-density_map_data = pd.read_csv("DensityMapDataV3.csv")
-top_ai_skills_data = pd.read_csv("TopAISkillsChartData_CareerArea.csv")
-top_ai_career_data = pd.read_csv("TopAICareerDataV2_with_other.csv")   # for share
-career_intensity_data = pd.read_csv("CareerAreaIntensity.csv")         # for intensity
-
-state_abbrev = {
-    "Alabama": "AL","Alaska": "AK","Arizona": "AZ","Arkansas": "AR","California": "CA",
-    "Colorado": "CO","Connecticut": "CT","Delaware": "DE","Florida": "FL","Georgia": "GA",
-    "Hawaii": "HI","Idaho": "ID","Illinois": "IL","Indiana": "IN","Iowa": "IA",
-    "Kansas": "KS","Kentucky": "KY","Louisiana": "LA","Maine": "ME","Maryland": "MD",
-    "Massachusetts": "MA","Michigan": "MI","Minnesota": "MN","Mississippi": "MS",
-    "Missouri": "MO","Montana": "MT","Nebraska": "NE","Nevada": "NV","New Hampshire": "NH",
-    "New Jersey": "NJ","New Mexico": "NM","New York": "NY","North Carolina": "NC",
-    "North Dakota": "ND","Ohio": "OH","Oklahoma": "OK","Oregon": "OR","Pennsylvania": "PA",
-    "Rhode Island": "RI","South Carolina": "SC","South Dakota": "SD","Tennessee": "TN",
-    "Texas": "TX","Utah": "UT","Vermont": "VT","Virginia": "VA","Washington": "WA",
-    "West Virginia": "WV","Wisconsin": "WI","Wyoming": "WY","Washington, D.C.": "DC"
-}
-if "state_abbrev" not in density_map_data.columns:
-    density_map_data["state_abbrev"] = density_map_data["state_name"].map(state_abbrev)
+# Typed, categorical tables served from .snapshots/ when the CSVs are unchanged (see snapshot.py).
+# DATA_BACKEND=mmap (default) memory-maps the snapshot columns and the indexes derived from them
+# (stored per data version in .snapshots/<version>/) so all gunicorn workers on a host share one
+# physical copy; DATA_BACKEND=memory gives each worker its own.
+data_backend = os.environ.get("DATA_BACKEND", "mmap")
+
+# QUERY_BACKEND=sqlite answers the charts from an indexed on-disk SQLite copy of the CSVs
+# instead of in-memory tables, for data larger than RAM (see query.py)
+query_backend = os.environ.get("QUERY_BACKEND", "memory")
+
+# The current Dataset; replaced in the background when the CSVs change (DATA_POLL_SECONDS, 0 = off)
+datasets = DatasetManager(
+    lambda: load_dataset(mmap=data_backend == "mmap", backend=query_backend),
+    poll_seconds=float(os.environ.get("DATA_POLL_SECONDS", 30)),
+)
+
+
+# =========================
+# Figure cache
+# =========================
+class FigureCache:
+    """
+    Thread-safe LRU of figures as JSON text, bounded by the text's total length,
+    which is what the entries actually hold.
+    Keys include the dataset version, so reloaded data never hits old entries.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> JSON text
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, text):
+        if len(text) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = text
+            self._bytes += len(text)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+figure_cache = FigureCache(max_bytes=int(os.environ.get("FIGURE_CACHE_MAX_BYTES", 64 * 1024 * 1024)))
+
+# Concurrent builds of the same figure share one computation; with SINGLEFLIGHT_DIR set also
+# across worker processes, which read the finished figure's JSON back (see singleflight.py)
+figure_flights = singleflight.SingleFlight(dumps=str, loads=str)
+
+
+def figure_json(fig):
+    """A built figure's JSON text, encoded once for both the cache and the response."""
+    with phase("serialise"):
+        return pio.to_json(fig, validate=False)
+
+
+def cached_figure(normalise):
+    """
+    Serve a chart callback from figure_cache, then from the pre-rendered store
+    (see prerender.py), building the figure only when neither has it; identical
+    builds already in flight are joined rather than repeated (figure_flights).
+    `normalise` maps the callback's inputs to a hashable key so equivalent
+    selections share one entry. The dataset is pinned once and passed on, so
+    the key's version always matches the data the figure was built from.
+    Figures are returned as plain JSON dicts; Dash and partial_update take them
+    like a go.Figure.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, dataset=None):
+            dataset = dataset or datasets.current
+            args_key = normalise(*args)
+            key = (func.__name__, dataset.version, args_key)
+            text = figure_cache.get(key)
+            if text is not None:
+                metrics.set_cache_status("hit")
+                return json.loads(text)
+            text = prerender.load_figure(func.__name__, dataset.version, args_key)
+            if text is not None:
+                metrics.set_cache_status("store")
+            else:
+                text, shared = figure_flights.do(key, lambda: figure_json(func(*args, dataset=dataset)))
+                metrics.set_cache_status("coalesced" if shared else "miss")
+            figure_cache.put(key, text)
+            return json.loads(text)
+        wrapper.normalise = normalise
+        return wrapper
+    return decorator
+
+
+# Entries for older versions can never be hit again; free them as soon as data is swapped
+datasets.on_swap(lambda dataset: figure_cache.clear())
+
+
+def normalise_career_areas(career_areas):
+    if isinstance(career_areas, list) and "ALL" in career_areas:
+        return ("ALL",)
+    return tuple(sorted(set(career_areas or [])))
+
 
-# Colors / Style
-orange = "#FF8200"
-gray = "#4B4B4B"
-light_gray = "#d3d3d3"
-dark_gray = "#2f2f2f"
+def normalise_states(states):
+    """The compared states in selection order without repeats ("ALL" for every state); one name is one state."""
+    if isinstance(states, str):
+        return (states,)
+    if states and "ALL" in states:
+        return ("ALL",)
+    return tuple(dict.fromkeys(states or []))
+
+
+def comparison_states(states, reference, all_states):
+    """The states compared with the reference: the selection (every state for "ALL") minus the reference."""
+    selection = normalise_states(states)
+    if selection == ("ALL",):
+        selection = all_states
+    return [state for state in selection if state != reference]
+
+
+def versus(reference, states):
+    """Title part naming what the reference is compared with."""
+    if not states:
+        return reference
+    if len(states) <= 3:
+        return f"{reference} vs {', '.join(states)}"
+    return f"{reference} vs {len(states)} states"
+
+
+# =========================
+# Partial figure updates
+# =========================
+# What a Patch resends; everything else (layout, geo, colour scale, styling) stays in the browser
+patch_trace_props = ["x", "y", "z", "locations", "hovertext", "customdata", "name", "legendgroup", "offsetgroup"]
+region_fixed_props = ("locations", "hovertext")
+patch_layout_props = [("title", "text"), ("xaxis", "categoryarray"), ("xaxis", "title", "text"),
+                      ("yaxis", "title", "text")]
+
+
+def lookup(obj, *path):
+    """obj[a][b]... for a go.Figure or a figure's JSON dict; None where any part is unset."""
+    for part in path:
+        try:
+            obj = obj[part]
+        except KeyError:
+            return None
+        if obj is None:
+            return None
+    return obj
+
+
+def figure_skeleton(fig, dataset):
+    """
+    Identifies the parts of a figure a Patch leaves alone: data version, trace
+    types and hover templates (which differ between the map's share and trend
+    views, as do their colour axes). Region maps (traces with a geojson URL)
+    always list every region in the same order, so their geometry, locations
+    and names are part of the skeleton too and a Patch only sends the values.
+    """
+    return f"{dataset.version}:" + ",".join(
+        f"{lookup(trace, 'type')}|{lookup(trace, 'hovertemplate')}|{lookup(trace, 'geojson')}"
+        for trace in fig["data"])
+
+
+def partial_update(fig, dataset, rendered_skeleton):
+    """
+    (figure, skeleton) for a graph callback: the full figure on first render or
+    when the skeleton changed, otherwise a dash.Patch of just the data arrays,
+    names, category order and titles.
+    """
+    skeleton = figure_skeleton(fig, dataset)
+    if skeleton != rendered_skeleton:
+        return fig, skeleton
+
+    patch = dash.Patch()
+    for i, trace in enumerate(fig["data"]):
+        fixed = region_fixed_props if lookup(trace, "geojson") is not None else ()
+        for prop in patch_trace_props:
+            if prop in fixed:
+                continue
+            value = lookup(trace, prop)
+            if value is not None:
+                patch["data"][i][prop] = value
+        color = lookup(trace, "marker", "color")
+        if color is not None:
+            patch["data"][i]["marker"]["color"] = color
+    for path in patch_layout_props:
+        value = lookup(fig["layout"], *path)
+        if value is not None:
+            target = patch["layout"]
+            for part in path[:-1]:
+                target = target[part]
+            target[path[-1]] = value
+    return patch, dash.no_update
+
+
+# Colors / Style (shared with the chart builders in figures.py)
+from figures import orange, gray, dark_gray
 
 
 # =========================
@@ -46,6 +256,38 @@ app = dash.Dash(
     external_stylesheets=[dbc.themes.BOOTSTRAP, "https://fonts.googleapis.com/css2?family=Montserrat&display=swap"]
 )
 
+# BACKGROUND_CALLBACKS=1 runs the chart callbacks as Dash background callbacks: the request
+# returns at once and the figure is built in a job process managed through a local disk cache
+# (BACKGROUND_CACHE_DIR), so slow figures don't hold a gunicorn worker. Results are kept for
+# BACKGROUND_CACHE_SECONDS per data version and inputs.
+# Needs the optional diskcache extras: pip install "dash[diskcache]"
+# CLIENTSIDE_CHARTS=1 sends compact per-state tables to the browser with the page (career_data,
+# skills_data) and draws the career chart, and the skills chart for a single career area, there
+# (assets/clientside.js); only multi-area skills selections still go to the server.
+clientside_charts = os.environ.get("CLIENTSIDE_CHARTS", "0") == "1"
+
+background_callbacks = os.environ.get("BACKGROUND_CALLBACKS", "0") == "1"
+chart_callback_options = {}
+if background_callbacks:
+    import diskcache
+
+    chart_callback_options = {
+        "background": True,
+        "manager": dash.DiskcacheManager(
+            diskcache.Cache(os.environ.get("BACKGROUND_CACHE_DIR", ".background-cache")),
+            cache_by=[lambda: datasets.current.version],
+            expire=int(os.environ.get("BACKGROUND_CACHE_SECONDS", 600)),
+        ),
+    }
+
+def reference_options(states):
+    return [{"label": f"{national} (all states)", "value": national}] + [{"label": s, "value": s} for s in states]
+
+
+def compare_options(states):
+    return [{"label": "Select All", "value": "ALL"}] + reference_options(states)
+
+
 def info_box(button_id, collapse_id, text):
     return html.Div([
         dbc.Button("ℹ️ Info", id=button_id, color="secondary", size="sm", style={"marginTop": "10px"}),
@@ -56,39 +298,36 @@ def info_box(button_id, collapse_id, text):
         )
     ])
 
-app.layout = html.Div([
-    dcc.Tabs(
-        id="tabs",
-        value="tab1",
-        children=[
-            dcc.Tab(label="Evolution of AI jobs", value="tab1"),
-            dcc.Tab(label="AI job intensity in Careers", value="tab2"),
-            dcc.Tab(label="Top AI skills", value="tab3"),
-        ],
-        style={
-            "fontFamily": "Gotham, sans-serif",
-            "color": orange,
-            "backgroundColor": dark_gray,
-        },
-        colors={
-            "border": gray,
-            "primary": orange,
-            "background": dark_gray
-        }
-    ),
-    html.Div(id="tabs-content")
-], style={"backgroundColor": gray, "padding": "20px", "fontFamily": "Gotham, sans-serif"})
+def build_layout(dataset):
+    return html.Div([
+        dcc.Tabs(
+            id="tabs",
+            value="tab1",
+            children=[
+                dcc.Tab(tab_content("tab1", dataset), label="Evolution of AI jobs", value="tab1"),
+                dcc.Tab(tab_content("tab2", dataset), label="AI job intensity in Careers", value="tab2"),
+                dcc.Tab(tab_content("tab3", dataset), label="Top AI skills", value="tab3"),
+            ],
+            style={
+                "fontFamily": "Gotham, sans-serif",
+                "color": orange,
+                "backgroundColor": dark_gray,
+            },
+            colors={
+                "border": gray,
+                "primary": orange,
+                "background": dark_gray
+            }
+        ),
+    ], style={"backgroundColor": gray, "padding": "20px", "fontFamily": "Gotham, sans-serif"})
 
 # =========================
-# Tab router
+# Tab layouts
 # =========================
-@app.callback(
-    dash.Output("tabs-content", "children"),
-    dash.Input("tabs", "value")
-)
-def render_content(tab):
+def tab_content(tab, dataset):
+    options = dataset.options
     if tab == "tab1":
-        years_sorted = sorted(density_map_data["year"].dropna().unique())
+        years_sorted = options["years"]
         min_year, max_year = int(min(years_sorted)), int(max(years_sorted))
 
         density_text = """
@@ -98,6 +337,9 @@ Metric: Proportion of AI jobs in state out of total jobs in state
 Proportion of AI jobs in state out of all AI jobs in country
 -Shows the percentage of all AI job postings in the USA that occur in each state.
 
+Trend and forecast
+-Colours each state by the yearly change (percentage points per year) of a straight line fitted to its yearly proportion of AI jobs out of total jobs, over all years. Hover shows the latest proportion and the line's forecast a few years ahead. The year slider and Play do not apply.
+
 “AI jobs” are jobs with skills that classify as involving or relating to AI (e.g. Machine Learning, Data Science, etc.)
         """
 
@@ -107,11 +349,25 @@ Proportion of AI jobs in state out of all AI jobs in country
                 id="density_metric",
                 options=[
                     {"label": "Proportion of AI jobs in state out of total jobs in state", "value": "state_share"},
-                    {"label": "Proportion of AI jobs in state out of all AI jobs in country", "value": "us_share"}
+                    {"label": "Proportion of AI jobs in state out of all AI jobs in country", "value": "us_share"},
+                    {"label": "Trend and forecast of proportion of AI jobs in state out of total jobs in state",
+                     "value": "trend"}
                 ],
                 value="state_share",
                 labelStyle={"display": "block", "color": "#ffffff", "marginBottom": "6px"}
             ),
+            # Counties / metro areas, when their data and boundary files are installed
+            html.Div([
+                html.Label("Level:", style={"color": "#ffffff", "marginBottom": "6px"}),
+                dcc.RadioItems(
+                    id="density_level",
+                    options=[{"label": density_levels[level]["label"].capitalize(), "value": level}
+                             for level in options["density_levels"]],
+                    value="state",
+                    inline=True,
+                    labelStyle={"color": "#ffffff", "marginRight": "12px"}
+                ),
+            ], style={"marginBottom": "6px"} if len(options["density_levels"]) > 1 else {"display": "none"}),
 
             html.Div([
     html.Button("▶ Play", id="play_button", n_clicks=0,
@@ -132,11 +388,13 @@ Proportion of AI jobs in state out of all AI jobs in country
     dcc.Interval(id="year_interval", interval=1200, n_intervals=0, disabled=True),
 
     
-    dcc.Store(id="selected_year_pool")
+    dcc.Store(id="selected_year_pool"),
+    dcc.Store(id="animation_position")
 ], style={"marginBottom": "15px"}),
             
 
             dcc.Graph(id="density_map"),
+            dcc.Store(id="density_map_skeleton"),
             info_box("density_info_btn", "density_info_collapse", density_text)
         ])
 
@@ -150,6 +408,9 @@ AI intensity within career area
 -This view shows the top 10 career areas in a selected state, ranked by AI intensity (AI jobs / all jobs in that career area × 100). It highlights which sectors are more AI-focused relative to their overall job volume.
 Some career areas may have very small overall job counts, which can inflate percentages. This view is sensitive to low denominators.
 
+Comparison
+-The reference's top 10 career areas are shown next to the same areas in each compared state (0 where a state has none). "United States" is the average over all states, counting a state without a career area as 0.
+
 “AI jobs” are jobs with skills that classify as involving or relating to AI (e.g. Machine Learning, Data Science, etc.)
         """
 
@@ -164,28 +425,31 @@ Some career areas may have very small overall job counts, which can inflate perc
                 value="share",
                 labelStyle={"display": "block", "color": "#ffffff", "marginBottom": "6px"}
             ),
-            html.Label("Select State 1:", style={"color": "#ffffff", "marginTop": "4px"}),
+            html.Label("Reference (top 10 from):", style={"color": "#ffffff", "marginTop": "4px"}),
             dcc.Dropdown(
                 id="career_state_1",
-                options=[{"label": s, "value": s} for s in sorted(top_ai_career_data["state_name"].unique())],
+                options=reference_options(options["career_states"]),
                 value="California",
                 clearable=False
             ),
-            html.Label("Select State 2:", style={"color": "#ffffff", "marginTop": "10px"}),
+            html.Label("Compare with:", style={"color": "#ffffff", "marginTop": "10px"}),
             dcc.Dropdown(
                 id="career_state_2",
-                options=[{"label": s, "value": s} for s in sorted(top_ai_career_data["state_name"].unique())],
-                value="Tennessee",
-                clearable=False
+                options=compare_options(options["career_states"]),
+                value=["Tennessee"],
+                multi=True,
+                style={"color": "black"},
             ),
             dcc.Graph(id="career_comparison_chart"),
+            dcc.Store(id="career_comparison_chart_skeleton"),
+            *([dcc.Store(id="career_data", data=career_payload(dataset))] if clientside_charts else []),
             info_box("career_info_btn", "career_info_collapse", career_text)
         ])
 
     elif tab == "tab3":
         skills_text = """
     Skills Comparison
-    This chart compares the top 10 AI-related skills in a selected state (by proportion of AI postings mentioning them), with a second state shown side-by-side for the same skills. It highlights which technical skills dominate in each location.
+    This chart compares the top 10 AI-related skills in a reference state (by proportion of AI postings mentioning them), with any number of other states shown side-by-side for the same skills. "United States" sums the postings and skill mentions of all states. It highlights which technical skills dominate in each location.
     Skills are extracted from job postings and may overlap (one posting can list multiple skills). This view reflects mentions of skills, not unique job postings.
     The chart can be filtered by one or more career areas, with the resulting bars being aggregated across selected career areas. 
 
@@ -196,22 +460,23 @@ Some career areas may have very small overall job counts, which can inflate perc
             # Filter bar (all in one horizontal row)
             dbc.Row([
                 dbc.Col([
-                    html.Label("Select State 1:", style={"color": "#ffffff", "marginTop": "4px"}),
+                    html.Label("Reference (top 10 from):", style={"color": "#ffffff", "marginTop": "4px"}),
                     dcc.Dropdown(
                         id="skills_state_1",
-                        options=[{"label": s, "value": s} for s in sorted(top_ai_skills_data["state_name"].unique())],
+                        options=reference_options(options["skills_states"]),
                         value="California",
                         clearable=False,
                     ),
                 ], width=3),
 
                 dbc.Col([
-                    html.Label("Select State 2:", style={"color": "#ffffff", "marginTop": "4px"}),
+                    html.Label("Compare with:", style={"color": "#ffffff", "marginTop": "4px"}),
                     dcc.Dropdown(
                         id="skills_state_2",
-                        options=[{"label": s, "value": s} for s in sorted(top_ai_skills_data["state_name"].unique())],
-                        value="Tennessee",
-                        clearable=False,
+                        options=compare_options(options["skills_states"]),
+                        value=["Tennessee"],
+                        multi=True,
+                        style={"color": "black"},
                     ),
                 ], width=3),
 
@@ -221,7 +486,7 @@ Some career areas may have very small overall job counts, which can inflate perc
                         id="skills_career_area",
                         options=(
                             [{"label": "Select All", "value": "ALL"}] +
-                            [{"label": ca, "value": ca} for ca in sorted(top_ai_skills_data["lot_career_area_name"].unique())]
+                            [{"label": ca, "value": ca} for ca in options["skills_career_areas"]]
                         ),
                         value=["ALL"],
                         multi=True,
@@ -233,9 +498,31 @@ Some career areas may have very small overall job counts, which can inflate perc
 
             # Chart and info below filters
             dcc.Graph(id="skills_comparison_chart", style={"height": "70vh"}),
+            dcc.Store(id="skills_comparison_chart_skeleton"),
+            *([dcc.Store(id="skills_data", data=skills_payload(dataset)), dcc.Store(id="skills_server_request")]
+              if clientside_charts else []),
             info_box("skills_info_btn", "skills_info_collapse", skills_text)
         ])
 
+
+# The page layout is built once per dataset version. All three tabs live in it, so
+# switching tabs happens in the browser without a server round trip.
+page_layouts = {}
+page_layouts_lock = threading.Lock()
+
+
+def serve_layout():
+    dataset = datasets.current
+    with page_layouts_lock:
+        layout = page_layouts.get(dataset.version)
+        if layout is None:
+            page_layouts.clear()
+            layout = page_layouts[dataset.version] = build_layout(dataset)
+    return layout
+
+
+app.layout = serve_layout
+
 # =========================
 # Chart Callbacks
 # =========================
@@ -243,305 +530,380 @@ Some career areas may have very small overall job counts, which can inflate perc
 # Density map (multi-year)
 from dash.exceptions import PreventUpdate
 
+def density_values(dataset, metric, start_year, end_year, level="state"):
+    """Per-area map values (%) over [start_year, end_year]: (names, location codes, values, title)."""
+    # Aggregate across selected years (states with no rows in range are left off the map;
+    # regions without rows stay on it as NaN, uncoloured)
+    names, codes, ai_jobs, all_jobs = dataset.queries.density_totals(start_year, end_year, level)
+    unit = density_levels[level]["label"]
+
+    if metric == "state_share":
+        value = np.divide(ai_jobs, all_jobs, out=np.zeros_like(ai_jobs), where=all_jobs > 0)
+        color_title = f"Proportion of AI jobs in {unit} out of total jobs in {unit}"
+    else:
+        us_total = np.nansum(ai_jobs)
+        value = ai_jobs / us_total if us_total > 0 else np.zeros_like(ai_jobs)
+        color_title = f"Proportion of AI jobs in {unit} out of all AI jobs in US"
+    value[np.isnan(ai_jobs)] = np.nan
+
+    title = f"{color_title} ({start_year})"
+    return names, codes, value * 100, title
+
+
+def animation_frames(dataset, metric, year_range, level="state"):
+    """
+    One map frame per year in year_range (or every year if the range holds none).
+    Region frames carry only values: their locations are the same every year.
+    """
+    all_years = [int(y) for y in dataset.queries.density_years(level)]
+    start, end = int(year_range[0]), int(year_range[1])
+    pool = [y for y in all_years if start <= y <= end] or all_years
+
+    frames = []
+    for year in pool:
+        names, codes, values, title = density_values(dataset, metric, year, year, level)
+        frame = {"z": [None if np.isnan(v) else v for v in values.round(6).tolist()], "title": title}
+        if level == "state":
+            frame.update(locations=list(codes), hovertext=list(names))
+        frames.append(frame)
+    return {"years": pool, "frames": frames}
+
+
+# Play builds every year frame for the selected pool once; ticks, pause and
+# looping then run in the browser (assets/clientside.js), not on the server.
 @app.callback(
-    Output("density_years", "value"),
-    Output("year_interval", "disabled"),
-    Output("play_button", "children"),      # toggle button label
-    Output("selected_year_pool", "data"),   # remember the years to cycle through
+    Output("selected_year_pool", "data"),   # frames for the years to cycle through
     Input("play_button", "n_clicks"),
-    Input("year_interval", "n_intervals"),
+    Input("density_metric", "value"),
+    Input("density_level", "value"),
     State("density_years", "value"),
     State("year_interval", "disabled"),
-    State("selected_year_pool", "data"),
     prevent_initial_call=True
 )
-def animate_slider(n_clicks, n_intervals, year_range, is_disabled, pool):
+def build_animation_frames(n_clicks, metric, level, year_range, is_disabled):
     ctx = dash.callback_context
-    if not ctx.triggered:
-        raise PreventUpdate
-
-    trigger = ctx.triggered[0]["prop_id"].split(".")[0]
-    all_years = sorted(density_map_data["year"].unique())
-
-    # --- Play/Pause toggle ---
-    if trigger == "play_button":
-        new_disabled = not is_disabled            # False = playing, True = paused
-        label = "⏸ Pause" if not new_disabled else "▶ Play"
+    trigger = ctx.triggered[0]["prop_id"].split(".")[0] if ctx.triggered else None
 
-        # If starting playback, capture the pool of years to animate through
-        if not new_disabled:
-            start, end = int(year_range[0]), int(year_range[1])
-            selected = [y for y in all_years if start <= y <= end] or all_years
-            return year_range, new_disabled, label, selected
-        else:
-            # Pausing: keep current pool
-            return year_range, new_disabled, label, pool
+    playing = not is_disabled
+    if trigger == "play_button" and playing:
+        raise PreventUpdate     # pausing is handled client-side
+    if trigger in ("density_metric", "density_level") and not playing:
+        raise PreventUpdate     # a metric or level change only needs new frames while playing
 
-    # --- Interval tick (while playing) ---
-    # Use the stored pool; if missing, derive from current selection or default to all
-    if not pool:
-        start, end = int(year_range[0]), int(year_range[1])
-        pool = [y for y in all_years if start <= y <= end] or all_years
+    if metric == "trend":
+        # The trend map has no per-year frames: an empty pool stops playback
+        return {"years": [], "frames": [], "n_clicks": n_clicks}
 
-    current_year = int(year_range[0])  # we drive the slider as [y, y]
-    if current_year not in pool:
-        current_year = pool[0]
+    # n_clicks makes every Play press a new value, so playback restarts even for an identical pool
+    with phase("aggregate"):
+        return dict(animation_frames(datasets.current, metric, year_range, level), n_clicks=n_clicks)
 
-    idx = pool.index(current_year)
-    next_year = pool[(idx + 1) % len(pool)]
 
-    # Move to next single year, keep playing, keep the same pool, label = Pause
-    return [next_year, next_year], False, "⏸ Pause", pool
+app.clientside_callback(
+    dash.ClientsideFunction(namespace="density", function_name="animate"),
+    Output("density_map", "figure", allow_duplicate=True),
+    Output("density_years", "value"),
+    Output("year_interval", "disabled"),
+    Output("play_button", "children"),      # toggle button label
+    Output("animation_position", "data"),   # index of the frame on screen
+    Input("selected_year_pool", "data"),
+    Input("play_button", "n_clicks"),
+    Input("year_interval", "n_intervals"),
+    State("year_interval", "disabled"),
+    State("animation_position", "data"),
+    State("density_map", "figure"),
+    prevent_initial_call=True
+)
 
 
 # ======================================
 # Density Map Update
 # ======================================
+def density_key(metric, years_range, level="state"):
+    # The trend view is fitted over every year once per dataset, so the slider does not change it
+    key = (metric,) if metric == "trend" else (metric, int(years_range[0]), int(years_range[1]))
+    return key if level == "state" else (*key, level)
+
+
+def density_geometry(dataset, level):
+    """URL of the level's prepared boundaries (None for states, drawn from plotly's own)."""
+    return None if level == "state" else geometry.url(dataset.geometry[level])
+
+
+def trend_figure(dataset, level="state"):
+    """Map of each area's fitted yearly change in AI share of its jobs, with the forecast in the hover."""
+    with phase("aggregate"):
+        trends = dataset.density_trends[level]
+        years = dataset.queries.density_years(level)
+        unit = density_levels[level]["label"]
+        forecast_year = trends["forecast_year"]
+        customdata = np.column_stack([trends["latest"], trends["latest_year"], trends["forecast"]])
+        title = (f"Trend in proportion of AI jobs in {unit} out of total jobs in {unit}, "
+                 f"{int(min(years))}–{int(max(years))} (percentage points per year)")
+        hovertemplate = ("<b>%{hovertext}</b><br>Trend: %{z:+.2f} pp/year<br>"
+                         "%{customdata[1]:.0f}: %{customdata[0]:.2f}%<br>"
+                         f"Forecast {forecast_year}: " + "%{customdata[2]:.2f}%<extra></extra>")
+
+    with phase("figure"):
+        return figures.trend_choropleth(trends["codes"], trends["names"], trends["slope"],
+                                        customdata, title, hovertemplate, geojson=density_geometry(dataset, level))
+
+
+@cached_figure(density_key)
+def density_figure(metric, years_range, level="state", dataset=None):
+    dataset = dataset or datasets.current
+    if metric == "trend":
+        return trend_figure(dataset, level)
+    start_year, end_year = int(years_range[0]), int(years_range[1])
+
+    with phase("aggregate"):
+        names, codes, values, title = density_values(dataset, metric, start_year, end_year, level)
+
+    with phase("figure"):
+        fig = figures.choropleth(codes, names, values, title, geojson=density_geometry(dataset, level))
+    return fig
+
+
 @app.callback(
     Output("density_map", "figure"),
+    Output("density_map_skeleton", "data"),
     Input("density_metric", "value"),
-    Input("density_years", "value")
+    Input("density_years", "value"),
+    Input("density_level", "value"),
+    State("density_map_skeleton", "data"),
+    **chart_callback_options
 )
-def update_density_map(metric, years_range):
-    start_year, end_year = int(years_range[0]), int(years_range[1])
-    df_years = density_map_data[
-        (density_map_data["year"] >= start_year) &
-        (density_map_data["year"] <= end_year)
-    ].copy()
-
-    # Aggregate across selected years
-    state_agg = (
-        df_years.groupby(["state_name", "state_abbrev"], as_index=False)
-        .agg(ai_jobs_count=("ai_jobs_count", "sum"),
-             all_jobs_state_year=("all_jobs_state_year", "sum"))
-    )
+def update_density_map(metric, years_range, level, rendered_skeleton):
+    dataset = datasets.current
+    return partial_update(density_figure(metric, years_range, level, dataset=dataset), dataset, rendered_skeleton)
 
-    if metric == "state_share":
-        state_agg["value"] = state_agg.apply(
-            lambda r: (r["ai_jobs_count"] / r["all_jobs_state_year"])
-            if r["all_jobs_state_year"] > 0 else 0,
-            axis=1
-        )
-        color_title = "Proportion of AI jobs in state out of total jobs in state"
-    else:
-        us_total = state_agg["ai_jobs_count"].sum()
-        state_agg["value"] = state_agg.apply(
-            lambda r: (r["ai_jobs_count"] / us_total)
-            if us_total > 0 else 0,
-            axis=1
-        )
-        color_title = "Proportion of AI jobs in state out of all AI jobs in US"
-
-    state_agg["value"] *= 100
-
-    fig = px.choropleth(
-        state_agg,
-        locations="state_abbrev",
-        locationmode="USA-states",
-        color="value",
-        hover_name="state_name",
-        scope="usa",
-        color_continuous_scale="Blues"
-    )
 
-    fig.update_traces(hovertemplate="<b>%{hovertext}</b><br>%{z:.2f}%<extra></extra>")
-    fig.update_geos(bgcolor=gray)
-    fig.update_layout(
-        paper_bgcolor=gray,
-        plot_bgcolor=gray,
-        font=dict(color="white", family="Gotham, sans-serif"),
-        title=f"{color_title} ({start_year})",
-        margin={"r": 0, "t": 30, "l": 0, "b": 0},
-        coloraxis_showscale=False
-    )
-    return fig
 # Career comparison with toggle (share vs intensity)
-@app.callback(
-    dash.Output("career_comparison_chart", "figure"),
-    [
-        dash.Input("career_state_1", "value"),
-        dash.Input("career_state_2", "value"),
-        dash.Input("career_metric", "value")
-    ]
-)
-def update_career_chart(state1, state2, metric):
-    if metric == "share":
-        df = top_ai_career_data.copy()
-        df = df[~df["lot_career_area_name"].fillna("").str.strip().str.lower().isin(
-            {"other", "other/unknown", "other / unknown", "unknown", "misc", "other, misc"}
-        )]
-        df["proportion"] = df["proportion"] * 100
-        ycol, label, title_suffix = "proportion", "AI Share of State’s AI Jobs (%)", "AI Share"
-    else:
-        df = career_intensity_data.copy()
-        df = df[~df["lot_career_area_name"].fillna("").str.strip().str.lower().isin(
-            {"other", "other/unknown", "other / unknown", "unknown", "misc", "other, misc"}
-        )]
-        df["intensity"] = pd.to_numeric(df["intensity"], errors="coerce").fillna(0) * 100
-        ycol, label, title_suffix = "intensity", "AI Intensity (%)", "AI Intensity"
-
-    # First state
-    s1 = df[df["state_name"] == state1]
-    if s1.empty:
-        fig = px.bar(title=f"No data for {state1}")
-        fig.update_layout(
-            plot_bgcolor=light_gray,
-            paper_bgcolor=gray,
-            font=dict(color="white", family="Gotham, sans-serif")
+# metric -> (value column, axis label, title suffix)
+career_metrics = {
+    "share": ("proportion", "AI Share of State’s AI Jobs (%)", "AI Share"),
+    "intensity": ("intensity", "AI Intensity (%)", "AI Intensity"),
+}
+
+
+@cached_figure(lambda reference, states, metric: (reference, normalise_states(states), metric))
+def career_figure(reference, states, metric, dataset=None):
+    dataset = dataset or datasets.current
+    with phase("aggregate"):
+        ycol, label, title_suffix = career_metrics[metric]
+
+        # Reference: its top 10 areas set the categories
+        top10 = dataset.queries.career_top(reference, metric)
+        if top10.empty:
+            return figures.no_data_bars(f"No data for {reference}")
+
+        top_areas = top10["lot_career_area_name"].to_numpy(dtype=object)
+
+        # Every compared state aligned to the same areas in one state x area lookup (0 where it has none)
+        states = comparison_states(states, reference, dataset.options["career_states"])
+        values = dataset.queries.career_matrix(states, metric, list(top_areas))
+
+    with phase("figure"):
+        fig = figures.grouped_bars(
+            top_areas, top10[ycol].to_numpy(dtype=float), values, reference, states,
+            title=f"Top 10 AI Career Areas ({title_suffix}) — {versus(reference, states)}",
+            x_title="Career Area",
+            y_title=label,
+            hovertemplate="<b>%{x}</b><br>%{y:.2f}%<extra></extra>",
         )
-        return fig
-
-    s1_top10 = s1.sort_values(ycol, ascending=False).head(10)
-    top_areas = list(s1_top10["lot_career_area_name"])
-
-    # Second state (restricted to same top areas)
-    s2 = df[(df["state_name"] == state2) & (df["lot_career_area_name"].isin(top_areas))]
-    s2_complete = pd.DataFrame({"lot_career_area_name": top_areas}).merge(
-        s2[["lot_career_area_name", ycol]], on="lot_career_area_name", how="left"
-    ).assign(state_name=state2)
-    s2_complete[ycol] = s2_complete[ycol].fillna(0.0)
-
-    # Reformat first state data to match
-    s1_complete = s1_top10[["lot_career_area_name", ycol]].copy()
-    s1_complete["state_name"] = state1
-
-    # Combine both states
-    plot_df = pd.concat([s1_complete, s2_complete], ignore_index=True)
-
-    # Plot
-    fig = px.bar(
-        plot_df,
-        x="lot_career_area_name",
-        y=ycol,
-        color="state_name",
-        title=f"Top 10 AI Career Areas ({title_suffix}) — {state1} vs {state2}",
-        labels={"lot_career_area_name": "Career Area", ycol: label},
-        barmode="group",
-        color_discrete_map={state1: orange, state2: gray},
-    )
-    fig.update_xaxes(categoryorder="array", categoryarray=top_areas)
-    fig.update_traces(hovertemplate="<b>%{x}</b><br>%{y:.2f}%<extra></extra>")
-    fig.update_layout(
-        plot_bgcolor=light_gray,
-        paper_bgcolor=gray,
-        font=dict(color="white", family="Gotham, sans-serif"),
-        margin=dict(l=10, r=10, t=50, b=60)
-    )
     return fig
 
-# Skills comparison
-@app.callback(
-    Output("skills_comparison_chart", "figure"),
-    [
-        Input("skills_state_1", "value"),
-        Input("skills_state_2", "value"),
-        Input("skills_career_area", "value")
-    ]
-)
-def update_skills_chart(state1, state2, career_areas):
-    df = top_ai_skills_data.copy()
 
-    # Handle "Select All"
-    if isinstance(career_areas, list) and "ALL" in career_areas:
-        pass
-    else:
-        df = df[df["lot_career_area_name"].isin(career_areas)]
-
-    # Clean up bad skill names
-    bad = {"other", "other/unknown", "other / unknown", "unknown", "misc", "other, misc"}
-    df = df[~df["skills_name"].fillna("").str.strip().str.lower().isin(bad)]
-
-    # Ensure numeric
-    df["skill_count"] = pd.to_numeric(df["skill_count"], errors="coerce").fillna(0)
-    df["total_ai_listings"] = pd.to_numeric(df["total_ai_listings"], errors="coerce").fillna(0)
-
-    # ---------- Build COMMON denominators per state ----------
-    # Each (state, career area) has one total_ai_listings value, but it repeats for every skill.
-    # Deduplicate by (state, career) before summing.
-    state_area_totals = (
-        df[["state_name", "lot_career_area_name", "total_ai_listings"]]
-        .drop_duplicates()
-        .groupby("state_name", as_index=False)["total_ai_listings"].sum()
-        .rename(columns={"total_ai_listings": "state_denominator"})
-    )
+def update_career_chart(state1, state2, metric, rendered_skeleton):
+    dataset = datasets.current
+    return partial_update(career_figure(state1, state2, metric, dataset=dataset), dataset, rendered_skeleton)
+
 
-    # ---------- Sum numerators (skill counts) per state+skill ----------
-    numerators = (
-        df.groupby(["state_name", "skills_name"], as_index=False)
-          .agg(skill_count=("skill_count", "sum"))
+if clientside_charts:
+    app.clientside_callback(
+        dash.ClientsideFunction(namespace="career", function_name="compare"),
+        dash.Output("career_comparison_chart", "figure"),
+        dash.Input("career_state_1", "value"),
+        dash.Input("career_state_2", "value"),
+        dash.Input("career_metric", "value"),
+        dash.State("career_data", "data"),
     )
+else:
+    app.callback(
+        dash.Output("career_comparison_chart", "figure"),
+        dash.Output("career_comparison_chart_skeleton", "data"),
+        [
+            dash.Input("career_state_1", "value"),
+            dash.Input("career_state_2", "value"),
+            dash.Input("career_metric", "value")
+        ],
+        dash.State("career_comparison_chart_skeleton", "data"),
+        **chart_callback_options
+    )(update_career_chart)
 
-    # Merge common denominators
-    agg = numerators.merge(state_area_totals, on="state_name", how="left")
 
-    # Compute share (avoid divide-by-zero)
-    agg["proportion"] = agg.apply(
-        lambda r: (r["skill_count"] / r["state_denominator"]) if r["state_denominator"] > 0 else 0.0,
-        axis=1
-    )
-    agg["proportion"] *= 100
-
-    # ---------- Build comparison (Top 10 by State 1) ----------
-    s1 = agg[agg["state_name"] == state1].copy()
-    if s1.empty:
-        fig = px.bar(title=f"No data for {state1}")
-        fig.update_layout(
-            plot_bgcolor=light_gray,
-            paper_bgcolor=gray,
-            font=dict(color="white", family="Gotham, sans-serif")
+# Skills comparison
+@cached_figure(lambda reference, states, career_areas: (reference, normalise_states(states),
+                                                        normalise_career_areas(career_areas)))
+def skills_figure(reference, states, career_areas, dataset=None):
+    dataset = dataset or datasets.current
+    queries = dataset.queries
+
+    with phase("aggregate"):
+        # ---------- Build comparison (Top 10 by the reference; "ALL" selects every career area) ----------
+        top = queries.skills_top(reference, career_areas)
+        if top is None:
+            return figures.no_data_bars(f"No data for {reference}")
+
+        top_skills, counts, denominator, proportion = top
+
+        # Compared states aligned to the same skills in one lookup (missing skills show as 0)
+        states = comparison_states(states, reference, dataset.options["skills_states"])
+        state_counts, state_denominators, state_proportions, present = queries.skills_matrix(
+            states, career_areas, top_skills)
+
+        # Hover info per trace: counts and denominators
+        customdata = [np.column_stack([counts, np.full(len(top_skills), denominator)]).astype(float)]
+        customdata += list(np.stack([np.where(present, state_counts, 0),
+                                     np.where(present, state_denominators[:, None], 0)], axis=2).astype(float))
+
+    with phase("figure"):
+        # ---------- Plot ----------
+        fig = figures.grouped_bars(
+            top_skills, np.asarray(proportion, dtype=float), np.where(present, state_proportions, 0.0),
+            reference, states,
+            title=f"Top 10 AI Skills — {versus(reference, states)}",
+            x_title="Skill",
+            y_title="Share of selected AI postings mentioning skill (%)",
+            hovertemplate=(
+                "<b>%{x}</b><br>"
+                "%{y:.2f}%<br>"
+                "Mentions: %{customdata[0]} / %{customdata[1]} postings<extra></extra>"
+            ),
+            customdata=customdata,
         )
-        return fig
-
-    s1_top10 = s1.sort_values("proportion", ascending=False).head(10)
-    top_skills = list(s1_top10["skills_name"])
-
-    # State 2 aligned to same skills
-    s2 = agg[(agg["state_name"] == state2) & (agg["skills_name"].isin(top_skills))][
-        ["skills_name", "proportion", "skill_count", "state_denominator"]
-    ].copy()
-    s2_complete = (
-        pd.DataFrame({"skills_name": top_skills})
-        .merge(s2, on="skills_name", how="left")
-        .fillna({"proportion": 0.0, "skill_count": 0, "state_denominator": 0})
-        .assign(state_name=state2)
-    )
+    return fig
 
-    # State 1 formatted
-    s1_complete = s1_top10[["skills_name", "proportion", "skill_count", "state_denominator"]].copy()
-    s1_complete["state_name"] = state1
-
-    plot_df = pd.concat([s1_complete, s2_complete], ignore_index=True)
-
-    # ---------- Plot ----------
-    fig = px.bar(
-        plot_df,
-        x="skills_name",
-        y="proportion",
-        color="state_name",
-        title=f"Top 10 AI Skills — {state1} vs {state2}",
-        labels={"skills_name": "Skill", "proportion": "Share of selected AI postings mentioning skill (%)"},
-        barmode="group",
-        color_discrete_map={state1: orange, state2: gray},
-    )
 
-    # Hover info: counts and denominators
-    fig.update_traces(
-        hovertemplate=(
-            "<b>%{x}</b><br>"
-            "%{y:.2f}%<br>"
-            "Mentions: %{customdata[0]} / %{customdata[1]} postings<extra></extra>"
-        ),
-        customdata=plot_df[["skill_count", "state_denominator"]].to_numpy()
+def update_skills_chart(state1, state2, career_areas, rendered_skeleton):
+    dataset = datasets.current
+    return partial_update(skills_figure(state1, state2, career_areas, dataset=dataset), dataset, rendered_skeleton)
+
+
+if clientside_charts:
+    # A single career area is drawn in the browser; anything else is handed to the server through
+    # skills_server_request. The browser's figure clears the skeleton so the server's next answer
+    # is a full figure rather than a Patch of it.
+    app.clientside_callback(
+        dash.ClientsideFunction(namespace="skills", function_name="compare"),
+        Output("skills_comparison_chart", "figure", allow_duplicate=True),
+        Output("skills_comparison_chart_skeleton", "data", allow_duplicate=True),
+        Output("skills_server_request", "data"),
+        Input("skills_state_1", "value"),
+        Input("skills_state_2", "value"),
+        Input("skills_career_area", "value"),
+        State("skills_data", "data"),
+        prevent_initial_call=True
     )
 
-    fig.update_xaxes(categoryorder="array", categoryarray=top_skills)
-    fig.update_layout(
-        plot_bgcolor=light_gray,
-        paper_bgcolor=gray,
-        font=dict(color="white", family="Gotham, sans-serif"),
-        margin=dict(l=10, r=10, t=50, b=60)
+    @app.callback(
+        Output("skills_comparison_chart", "figure"),
+        Output("skills_comparison_chart_skeleton", "data"),
+        Input("skills_server_request", "data"),
+        State("skills_state_1", "value"),
+        State("skills_state_2", "value"),
+        State("skills_career_area", "value"),
+        State("skills_comparison_chart_skeleton", "data"),
+        **chart_callback_options
     )
-    return fig
+    def update_skills_chart_on_request(request, state1, state2, career_areas, rendered_skeleton):
+        return update_skills_chart(state1, state2, career_areas, rendered_skeleton)
+else:
+    app.callback(
+        Output("skills_comparison_chart", "figure"),
+        Output("skills_comparison_chart_skeleton", "data"),
+        [
+            Input("skills_state_1", "value"),
+            Input("skills_state_2", "value"),
+            Input("skills_career_area", "value")
+        ],
+        State("skills_comparison_chart_skeleton", "data"),
+        **chart_callback_options
+    )(update_skills_chart)
+
+
+# =========================
+# Browser-side chart data
+# =========================
+def bar_skeleton(fig):
+    """A bar figure's layout and first trace without its data, for the browser to fill in (None if empty)."""
+    fig = json.loads(pio.to_json(fig, validate=False))
+    if not fig["data"]:
+        return None
+    trace = {k: v for k, v in fig["data"][0].items() if k not in ("x", "y", "customdata")}
+    return {"trace": trace, "layout": fig["layout"]}
+
+
+def first_skeleton(builder, states, *args, dataset):
+    for state in states:
+        skeleton = bar_skeleton(builder(state, state, *args, dataset=dataset))
+        if skeleton is not None:
+            return skeleton
+    return None
+
+
+def career_payload(dataset):
+    """
+    Every state's (and the national) career areas and values (%) per metric,
+    presorted largest first, as columns: {metric: {"states": {state: [area
+    indexes, values]}}} with the area names listed once in "areas".
+    """
+    states = dataset.options["career_states"]
+    area_index = {}
+    payload = {"colors": [orange, gray], "palette": figures.palette, "all_states": states}
+    for metric, (ycol, label, title_suffix) in career_metrics.items():
+        columns = {}
+        for state in [*states, national]:
+            top = dataset.queries.career_top(state, metric, n=None)
+            columns[state] = [
+                [area_index.setdefault(a if isinstance(a, str) else None, len(area_index))
+                 for a in top["lot_career_area_name"]],
+                [None if np.isnan(v) else float(v) for v in top[ycol]],
+            ]
+        payload[metric] = {"label": label, "title": title_suffix, "states": columns}
+    payload["areas"] = list(area_index)
+    payload["figure"] = first_skeleton(career_figure, states, "share", dataset=dataset)
+    return payload
+
+
+def skills_payload(dataset):
+    """
+    Per state (and the national total) and single career area, the present
+    skills presorted by share with their mention counts and the area's posting
+    total: {"states": {state: {area: [denominator, skill indexes, counts]}}}
+    with the skill names listed once in "skills".
+    """
+    states = dataset.options["skills_states"]
+    skill_index = {}
+    cells = {}
+    for state in [*states, national]:
+        cells[state] = {}
+        for area in dataset.options["skills_career_areas"]:
+            top = dataset.queries.skills_top(state, [area], n=None)
+            if top is None:
+                continue
+            skills, counts, denominator, _ = top
+            cells[state][area] = [float(denominator), [skill_index.setdefault(s, len(skill_index)) for s in skills],
+                                  counts.tolist()]
+    return {
+        "colors": [orange, gray],
+        "palette": figures.palette,
+        "all_states": states,
+        "skills": list(skill_index),
+        "states": cells,
+        "figure": first_skeleton(skills_figure, states, ["ALL"], dataset=dataset),
+    }
+
 
 # =========================
 # Info button toggles
@@ -581,6 +943,107 @@ def toggle_skills_info(n, is_open):
 # =========================
 server = app.server
 
+# gzip/brotli compression and content-hash ETags on callback responses (see compression.py)
+compression.init_app(server)
+
+# Time every server callback registered above (see metrics.py); keep this after the last @app.callback
+metrics.instrument_callbacks(app)
+
+
+# Start the data file poller in whichever process serves requests (i.e. after a gunicorn fork)
+@server.before_request
+def start_dataset_poller():
+    datasets.start()
+
+
+def worker_memory():
+    """This process's memory in bytes from /proc (Linux): rss, its anon/file/shmem split, and pss."""
+    stats = {}
+    for path, fields in (("/proc/self/status", ("VmRSS", "RssAnon", "RssFile", "RssShmem")),
+                         ("/proc/self/smaps_rollup", ("Pss",))):
+        try:
+            with open(path) as f:
+                for line in f:
+                    name, _, rest = line.partition(":")
+                    if name in fields:
+                        stats[name] = int(rest.split()[0]) * 1024
+        except OSError:
+            pass
+    return {
+        "pid": os.getpid(),
+        "data_backend": data_backend,
+        "rss": stats.get("VmRSS"),
+        "rss_anon": stats.get("RssAnon"),
+        "rss_file": stats.get("RssFile"),
+        "rss_shmem": stats.get("RssShmem"),
+        "pss": stats.get("Pss"),
+    }
+
+
+@server.route("/metrics")
+def metrics_route():
+    cache = figure_cache.stats()
+    memory = worker_memory()
+    extra = [
+        ("figure_cache_hits_total", "counter", "Figure cache hits.", cache["hits"]),
+        ("figure_cache_misses_total", "counter", "Figure cache misses.", cache["misses"]),
+        ("figure_cache_entries", "gauge", "Figures held in the cache.", cache["entries"]),
+        ("figure_cache_bytes", "gauge", "JSON size of the cached figures.", cache["bytes"]),
+        ("figure_builds_coalesced_total", "counter", "Figure builds answered by another identical build.",
+         figure_flights.shared),
+        ("worker_rss_bytes", "gauge", "Resident set size of this worker.", memory["rss"] or 0),
+        ("worker_pss_bytes", "gauge", "Proportional set size of this worker.", memory["pss"] or 0),
+    ]
+    return flask.Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+
+# Per-worker resident memory; with the mmap backend the dataset shows up in rss_file and
+# is shared, so pss (proportional share) is the per-worker cost to compare.
+@server.route("/_worker-memory")
+def worker_memory_route():
+    return flask.jsonify(worker_memory())
+
+
+# Pre-rendered figures as stored (gzipped JSON), for CDNs and clients that fetch figures directly.
+# The ETag is the data version plus figure key, so a 304 is valid until the data is swapped.
+@server.route("/_prerendered/<name>/<key>.json")
+def prerendered_route(name, key):
+    dataset = datasets.current
+    data = prerender.read_figure_bytes(name, dataset.version, key)
+    if data is None:
+        flask.abort(404)
+    # Each representation (gzipped or not) gets its own strong ETag, as in compression.py
+    etag = f"{dataset.version}-{key}"
+    if "gzip" in flask.request.accept_encodings:
+        response = flask.Response(data, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+        etag += "-gzip"
+    else:
+        response = flask.Response(gzip.decompress(data), mimetype="application/json")
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    response.set_etag(etag)
+    return response.make_conditional(flask.request)
+
+# Prepared region boundaries (geometry.py). File names carry a content hash, so they never
+# change: browsers and CDNs may keep them for good and fetch each one once.
+@server.route("/_geometry/<name>")
+def geometry_route(name):
+    data = geometry.read_geometry_bytes(name)
+    if data is None:
+        flask.abort(404)
+    etag = name
+    if "gzip" in flask.request.accept_encodings:
+        response = flask.Response(data, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+        etag += "-gzip"
+    else:
+        response = flask.Response(gzip.decompress(data), mimetype="application/json")
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    response.set_etag(etag)
+    return response.make_conditional(flask.request)
+
 import webbrowser
 
 if __name__ == "__main__":
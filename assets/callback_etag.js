@@ -0,0 +1,40 @@
+// Conditional callback requests (see compression.py). Browsers never revalidate POSTs,
+// so remember the latest responses to /_dash-update-component by request body and send
+// their ETag; an unchanged output then comes back as an empty 304 and is replayed here.
+(function () {
+    const maxEntries = 50;
+    const responses = new Map();    // request body -> {etag, body, contentType}, oldest first
+    const originalFetch = window.fetch.bind(window);
+
+    window.fetch = async function (input, init) {
+        const url = typeof input === "string" ? input : input.url;
+        if (!init || init.method !== "POST" || typeof init.body !== "string" ||
+                !url.endsWith("/_dash-update-component")) {
+            return originalFetch(input, init);
+        }
+
+        const key = init.body;
+        const cached = responses.get(key);
+        const headers = new Headers(init.headers || {});
+        if (cached) {
+            headers.set("If-None-Match", cached.etag);
+        }
+        const response = await originalFetch(input, Object.assign({}, init, {headers: headers}));
+
+        if (response.status === 304 && cached) {
+            responses.delete(key);
+            responses.set(key, cached);
+            return new Response(cached.body, {status: 200, headers: {"Content-Type": cached.contentType}});
+        }
+        const etag = response.headers.get("ETag");
+        if (response.status === 200 && etag) {
+            const body = await response.clone().text();
+            responses.delete(key);
+            responses.set(key, {etag: etag, body: body, contentType: response.headers.get("Content-Type")});
+            if (responses.size > maxEntries) {
+                responses.delete(responses.keys().next().value);
+            }
+        }
+        return response;
+    };
+})();
@@ -0,0 +1,223 @@
+// Browser-side callbacks registered from Oct9P2.py with dash.ClientsideFunction.
+
+// Grouped bar figure, as figures.grouped_bars draws it in Python, from the skeleton (layout and
+// first trace) shipped with the chart data: the reference in orange, then one trace per compared
+// state (gray for a single one, else the palette in turn). customdata, if given, is per trace.
+function groupedBars(data, reference, states, x, yRef, ys, customdata, title, yTitle) {
+    const skeleton = data.figure;
+    const trace = function (name, color, y, traceCustomdata) {
+        const t = Object.assign({}, skeleton.trace, {
+            name: name,
+            legendgroup: name,
+            offsetgroup: name,
+            marker: Object.assign({}, skeleton.trace.marker, {color: color}),
+            x: x,
+            y: y,
+        });
+        if (traceCustomdata) {
+            t.customdata = traceCustomdata;
+        }
+        return t;
+    };
+    const color = function (i) {
+        return states.length === 1 ? data.colors[1] : data.palette[i % data.palette.length];
+    };
+    const traces = [trace(reference, data.colors[0], yRef, customdata && customdata[0])].concat(
+        states.map(function (state, i) { return trace(state, color(i), ys[i], customdata && customdata[i + 1]); }));
+    const layout = Object.assign({}, skeleton.layout, {
+        title: Object.assign({}, skeleton.layout.title, {text: title}),
+        xaxis: Object.assign({}, skeleton.layout.xaxis, {categoryarray: x}),
+    });
+    if (yTitle) {
+        layout.yaxis = Object.assign({}, skeleton.layout.yaxis, {title: {text: yTitle}});
+    }
+    return {data: traces, layout: layout};
+}
+
+// The states compared with the reference (comparison_states in Oct9P2.py): the selection in order
+// without repeats, every state for "ALL", a single name as one state, minus the reference.
+function comparisonStates(selection, reference, allStates) {
+    let states = typeof selection === "string" ? [selection] : (selection || []);
+    if (states.indexOf("ALL") !== -1) {
+        states = allStates;
+    }
+    return Array.from(new Set(states)).filter(function (state) { return state !== reference; });
+}
+
+function versus(reference, states) {
+    if (!states.length) {
+        return reference;
+    }
+    return states.length <= 3 ? `${reference} vs ${states.join(", ")}` : `${reference} vs ${states.length} states`;
+}
+
+// The "No data for <state>" figure: px.bar without data (one empty trace) in the charts' colours
+function noDataFigure(data, state) {
+    const layout = data.figure.layout;
+    return {
+        data: [{
+            hovertemplate: "<extra></extra>",
+            legendgroup: "",
+            marker: {color: "#636efa", pattern: {shape: ""}},
+            name: "",
+            orientation: "v",
+            showlegend: false,
+            textposition: "auto",
+            xaxis: "x",
+            yaxis: "y",
+            type: "bar",
+        }],
+        layout: {
+            template: layout.template,
+            xaxis: {anchor: "y", domain: [0.0, 1.0]},
+            yaxis: {anchor: "x", domain: [0.0, 1.0]},
+            legend: {tracegroupgap: 0},
+            title: {text: `No data for ${state}`},
+            barmode: "relative",
+            font: layout.font,
+            plot_bgcolor: layout.plot_bgcolor,
+            paper_bgcolor: layout.paper_bgcolor,
+        },
+    };
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    density: {
+        // Year animation: the server sends all frames for the selected pool once
+        // (selected_year_pool); every tick, pause and loop is handled here.
+        animate: function (pool, nClicks, nIntervals, isDisabled, position, figure) {
+            const noUpdate = window.dash_clientside.no_update;
+            const ctx = window.dash_clientside.callback_context;
+            const trigger = ctx.triggered.length ? ctx.triggered[0].prop_id.split(".")[0] : null;
+            const unchanged = [noUpdate, noUpdate, noUpdate, noUpdate, noUpdate];
+
+            if (!pool || !pool.frames || !pool.frames.length) {
+                if (trigger === "selected_year_pool" && pool) {
+                    return [noUpdate, noUpdate, true, "▶ Play", noUpdate];  // nothing to play: stop
+                }
+                return unchanged;
+            }
+
+            let index;
+            if (trigger === "selected_year_pool") {
+                // Fresh frames from the server: start playback at the first year
+                index = 0;
+            } else if (trigger === "play_button") {
+                if (isDisabled) {
+                    return unchanged;   // starting: wait for the server to send frames
+                }
+                // Pausing: leave the slider on the year being shown
+                const year = pool.years[Math.min(position || 0, pool.years.length - 1)];
+                return [noUpdate, [year, year], true, "▶ Play", noUpdate];
+            } else {
+                if (isDisabled) {
+                    return unchanged;
+                }
+                index = ((position || 0) + 1) % pool.frames.length;
+            }
+
+            if (!figure || !figure.data || !figure.data.length) {
+                return [noUpdate, noUpdate, false, "⏸ Pause", index];
+            }
+            const frame = pool.frames[index];
+            const fig = Object.assign({}, figure, {
+                data: figure.data.slice(),
+                layout: Object.assign({}, figure.layout),
+            });
+            // Region frames only carry values: their locations are the same every year
+            fig.data[0] = Object.assign({}, figure.data[0], {z: frame.z});
+            if (frame.locations) {
+                fig.data[0].locations = frame.locations;
+                fig.data[0].hovertext = frame.hovertext;
+            }
+            fig.layout.title = Object.assign({}, figure.layout.title, {text: frame.title});
+            return [fig, noUpdate, false, "⏸ Pause", index];
+        },
+    },
+
+    career: {
+        // Top 10 career areas of the reference by the metric, and each compared state's values for
+        // the same areas (0 where it has none), from career_data (career_payload in Oct9P2.py).
+        compare: function (reference, selection, metric, data) {
+            if (!data || !data.figure) {
+                return window.dash_clientside.no_update;
+            }
+            const values = data[metric];
+            const ref = values.states[reference];
+            if (!ref || !ref[0].length) {
+                return noDataFigure(data, reference);
+            }
+            const top = ref[0].slice(0, 10);
+            const states = comparisonStates(selection, reference, data.all_states);
+            const ys = states.map(function (state) {
+                const columns = values.states[state] || [[], []];
+                const found = new Map();
+                columns[0].forEach(function (area, i) {
+                    if (!found.has(area)) {
+                        found.set(area, columns[1][i]);
+                    }
+                });
+                return top.map(function (area) { return found.get(area) ?? 0; });
+            });
+            return groupedBars(
+                data, reference, states,
+                top.map(function (area) { return data.areas[area]; }),
+                ref[1].slice(0, 10),
+                ys,
+                null,
+                `Top 10 AI Career Areas (${values.title}) — ${versus(reference, states)}`,
+                values.label,
+            );
+        },
+    },
+
+    skills: {
+        // Top 10 skills of the reference within one career area and each compared state's shares of
+        // the same skills, from skills_data (skills_payload in Oct9P2.py). Other selections sum
+        // several career areas; those are passed to the server through skills_server_request.
+        compare: function (reference, selection, careerAreas, data) {
+            const noUpdate = window.dash_clientside.no_update;
+            if (!data || !data.figure || !Array.isArray(careerAreas) || careerAreas.length !== 1 ||
+                    careerAreas[0] === "ALL") {
+                return [noUpdate, noUpdate, Date.now()];
+            }
+            const area = careerAreas[0];
+            const cell = (data.states[reference] || {})[area];
+            if (!cell || !cell[1].length) {
+                return [noDataFigure(data, reference), null, noUpdate];
+            }
+            const share = function (count, denominator) {
+                return denominator > 0 ? count / denominator * 100 : 0;
+            };
+            const [denominator, skills, counts] = cell;
+            const top = skills.slice(0, 10);
+            const refCounts = counts.slice(0, 10);
+
+            const states = comparisonStates(selection, reference, data.all_states);
+            const ys = [];
+            const customdata = [refCounts.map(function (c) { return [c, denominator]; })];
+            states.forEach(function (state) {
+                const [stateDenominator, stateSkills, stateCounts] = (data.states[state] || {})[area] || [0, [], []];
+                const found = new Map();
+                stateSkills.forEach(function (skill, i) {
+                    found.set(skill, stateCounts[i]);
+                });
+                const rows = top.map(function (skill) {
+                    return found.has(skill) ? [found.get(skill), stateDenominator] : [0, 0];
+                });
+                ys.push(rows.map(function (row) { return share(row[0], row[1]); }));
+                customdata.push(rows);
+            });
+            const fig = groupedBars(
+                data, reference, states,
+                top.map(function (skill) { return data.skills[skill]; }),
+                refCounts.map(function (c) { return share(c, denominator); }),
+                ys,
+                customdata,
+                `Top 10 AI Skills — ${versus(reference, states)}`,
+                null,
+            );
+            return [fig, null, noUpdate];
+        },
+    },
+});
@@ -0,0 +1,473 @@
+"""
+Browser-free latency benchmarks for the dashboard callbacks.
+
+Every chart callback is swept over state pairs, both metrics, year ranges and
+career-area selections, both as a direct Python call and through the Flask
+test client's /_dash-update-component endpoint. Results (p50/p95/p99 latency,
+payload and on-the-wire (compressed) bytes, peak traced memory) are written as
+JSON so runs can be compared. Each scale is run once per query backend
+(--backends memory sqlite; see query.py).
+
+    python benchmark.py run --scale 1 10 100 --output bench.json
+    python benchmark.py compare old.json new.json
+    python benchmark.py figures [--max-cases N]
+    python benchmark.py synth --scale 10 --dest /tmp/data10x
+
+Scaled datasets are synthesised by replicating the CSVs with new keys: more
+years for the density map, more career areas and skills per state.
+"""
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# =========================
+# Synthetic scaled data
+# =========================
+def synthesise(scale, dest, src=HERE, seed=0):
+    """Write scale x copies of the data files into dest, keyed so they stay distinct."""
+    from snapshot import TABLES
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(dest, exist_ok=True)
+    for name in TABLES:
+        df = pd.read_csv(os.path.join(src, name))
+        copies = [df]
+        for k in range(1, scale):
+            part = df.copy()
+            if name == "DensityMapDataV3.csv":
+                # Extend the year axis backwards: decades more history
+                span = int(df["year"].max() - df["year"].min() + 1)
+                part["year"] = part["year"] - k * span
+                jitter = rng.uniform(0.5, 1.5, len(part))
+                part["ai_jobs_count"] = (part["ai_jobs_count"] * jitter).round().astype(int)
+            elif name == "TopAISkillsChartData_CareerArea.csv":
+                # More skills per (state, career area); denominators are unchanged
+                part["skills_name"] = part["skills_name"] + f" #{k}"
+                jitter = rng.uniform(0.5, 1.5, len(part))
+                part["skill_count"] = np.minimum((part["skill_count"] * jitter).round(),
+                                                 part["total_ai_listings"]).astype(int)
+            else:
+                # More career areas per state
+                part["lot_career_area_name"] = part["lot_career_area_name"] + f" #{k}"
+            copies.append(part)
+        pd.concat(copies, ignore_index=True).to_csv(os.path.join(dest, name), index=False)
+    return dest
+
+
+# =========================
+# Cases
+# =========================
+def sample(cases, max_cases, seed=0):
+    if max_cases and len(cases) > max_cases:
+        cases = random.Random(seed).sample(cases, max_cases)
+    return cases
+
+
+def benchmark_cases(dataset, max_cases):
+    """Argument tuples per callback name, sampled down to max_cases each."""
+    career_states = dataset.options["career_states"]
+    skills_states = dataset.options["skills_states"]
+    areas = dataset.options["skills_career_areas"]
+    years = [int(y) for y in dataset.queries.density_years()]
+
+    rng = random.Random(1)
+    selections = [["ALL"]] + [[a] for a in areas] + [rng.sample(areas, min(3, len(areas))) for _ in range(5)]
+    ranges = [[a, b] for i, a in enumerate(years) for b in years[i:]]
+
+    return {
+        "update_density_map": sample([(m, r) for m in ("state_share", "us_share") for r in ranges], max_cases),
+        "update_career_chart": sample([(s1, s2, m) for m in ("share", "intensity")
+                                       for s1 in career_states for s2 in career_states], max_cases),
+        "update_skills_chart": sample([(s1, s2, sel) for sel in selections
+                                       for s1 in skills_states for s2 in skills_states], max_cases),
+        # Play button: (n_clicks, metric, year_range, interval disabled)
+        "build_animation_frames": sample([(1, m, r, True) for m in ("state_share", "us_share") for r in ranges],
+                                         max_cases),
+    }
+
+
+# Graph each chart callback draws into; its skeleton Store is "<graph>_skeleton"
+chart_graphs = {
+    "update_density_map": "density_map",
+    "update_career_chart": "career_comparison_chart",
+    "update_skills_chart": "skills_comparison_chart",
+}
+
+
+def dash_request(name, args, skeleton=None):
+    """
+    The /_dash-update-component body the browser would send for this callback
+    call. skeleton is what the browser's <graph>_skeleton Store holds (None on
+    first render, which forces a full figure).
+    """
+    def prop(component, prop_name, value):
+        return {"id": component, "property": prop_name, "value": value}
+
+    if name == "update_density_map":
+        inputs = [prop("density_metric", "value", args[0]), prop("density_years", "value", args[1]),
+                  prop("density_level", "value", "state")]
+    elif name == "update_career_chart":
+        inputs = [prop("career_state_1", "value", args[0]), prop("career_state_2", "value", args[1]),
+                  prop("career_metric", "value", args[2])]
+    elif name == "update_skills_chart":
+        inputs = [prop("skills_state_1", "value", args[0]), prop("skills_state_2", "value", args[1]),
+                  prop("skills_career_area", "value", args[2])]
+    else:
+        inputs = [prop("play_button", "n_clicks", args[0]), prop("density_metric", "value", args[1]),
+                  prop("density_level", "value", "state")]
+
+    if name in chart_graphs:
+        graph = chart_graphs[name]
+        outputs = [{"id": graph, "property": "figure"}, {"id": f"{graph}_skeleton", "property": "data"}]
+        output = f"..{graph}.figure...{graph}_skeleton.data.."
+        state = [prop(f"{graph}_skeleton", "data", skeleton)]
+    else:
+        outputs = {"id": "selected_year_pool", "property": "data"}
+        output = "selected_year_pool.data"
+        state = [prop("density_years", "value", args[2]), prop("year_interval", "disabled", args[3])]
+    return {
+        "output": output,
+        "outputs": outputs,
+        "inputs": inputs,
+        "changedPropIds": [f"{inputs[0]['id']}.{inputs[0]['property']}"],
+        "state": state,
+    }
+
+
+# =========================
+# Measurement
+# =========================
+def summarise(latencies, payloads, peak_bytes, wire=None):
+    ms = np.asarray(latencies) * 1000
+    summary = {
+        "calls": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "payload_bytes_mean": float(np.mean(payloads)),
+        "payload_bytes_max": int(np.max(payloads)),
+        "peak_traced_bytes": int(peak_bytes),
+    }
+    if wire is not None:
+        # What compression saved: payload is the callback's JSON, wire what was actually sent
+        summary["wire_bytes_mean"] = float(np.mean(wire))
+        summary["bytes_saved_mean"] = float(np.mean(payloads) - np.mean(wire))
+        summary["bytes_saved_pct"] = float((1 - np.sum(wire) / np.sum(payloads)) * 100)
+    return summary
+
+
+def decode_body(response):
+    """A test-client response body with its Content-Encoding undone."""
+    encoding = response.headers.get("Content-Encoding")
+    if encoding == "gzip":
+        return gzip.decompress(response.data)
+    if encoding == "br":
+        import brotli
+        return brotli.decompress(response.data)
+    return response.data
+
+
+def peak_memory(call, cases, limit=20):
+    """Largest tracemalloc peak over the first few cases (traced separately so latencies stay clean)."""
+    peak = 0
+    tracemalloc.start()
+    try:
+        for args in cases[:limit]:
+            tracemalloc.reset_peak()
+            call(args)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def sweep(app_module, max_cases, modes):
+    """Run every case for every callback in each mode; returns {mode: {callback: summary}}."""
+    import plotly.io as pio
+
+    callbacks = {
+        # The figure builders minus the figure cache, so every call measures a full computation
+        "update_density_map": app_module.density_figure.__wrapped__,
+        "update_career_chart": app_module.career_figure.__wrapped__,
+        "update_skills_chart": app_module.skills_figure.__wrapped__,
+        # Server half of the Play button (build_animation_frames minus its trigger checks)
+        "build_animation_frames": lambda n_clicks, metric, year_range, is_disabled, level="state": (
+            app_module.animation_frames(app_module.datasets.current, metric, year_range, level)),
+    }
+    all_cases = benchmark_cases(app_module.datasets.current, max_cases)
+    client = app_module.server.test_client()
+    accept_encoding = ", ".join(app_module.compression.encodings())
+    results = {}
+
+    for mode in modes:
+        results[mode] = {}
+        for name, func in callbacks.items():
+            cases = all_cases[name]
+            if mode == "direct":
+                def run(args, func=func):
+                    return func(*args)
+
+                def size(out):
+                    return len(pio.to_json(out) if hasattr(out, "to_plotly_json") else json.dumps(out))
+            else:
+                # Behave like one browser session: after the first full figure, send back the
+                # skeleton so later calls are answered with partial (Patch) updates
+                session = {"skeleton": None}
+
+                def run(args, name=name, session=session):
+                    response = client.post("/_dash-update-component",
+                                           json=dash_request(name, args, session["skeleton"]),
+                                           headers={"Accept-Encoding": accept_encoding})
+                    body = decode_body(response)
+                    graph = chart_graphs.get(name)
+                    if graph and response.status_code == 200:
+                        skeleton = json.loads(body)["response"].get(f"{graph}_skeleton")
+                        if skeleton:
+                            session["skeleton"] = skeleton["data"]
+                    return response, body
+
+                def size(out):
+                    return len(out[1])
+
+                def wire_size(out):
+                    return len(out[0].data)
+
+            latencies, payloads, wire = [], [], []
+            for args in cases:
+                app_module.figure_cache.clear()
+                start = time.perf_counter()
+                out = run(args)
+                latencies.append(time.perf_counter() - start)
+                payloads.append(size(out))
+                if mode == "http":
+                    wire.append(wire_size(out))
+            summary = summarise(latencies, payloads, peak_memory(run, cases), wire if mode == "http" else None)
+            results[mode][name] = summary
+            saved = f" saved={summary['bytes_saved_mean']:.0f}B/call ({summary['bytes_saved_pct']:.0f}%)" \
+                if "bytes_saved_mean" in summary else ""
+            print(f"  {mode:6s} {name:24s} p50={summary['p50_ms']:.2f}ms "
+                  f"p95={summary['p95_ms']:.2f}ms n={len(cases)}{saved}", file=sys.stderr)
+    return results
+
+
+# =========================
+# CLI
+# =========================
+def run_scale(scale, args):
+    """Benchmark one data scale with each query backend, in a fresh interpreter per run
+    (the app loads its data at import)."""
+    workdir = tempfile.mkdtemp(prefix=f"bench-{scale}x-")
+    try:
+        if scale == 1:
+            from snapshot import TABLES
+            for name in TABLES:
+                shutil.copy(os.path.join(HERE, name), workdir)
+        else:
+            synthesise(scale, workdir)
+        results = {}
+        for backend in args.backends:
+            print(f"  backend {backend}", file=sys.stderr)
+            out = os.path.join(workdir, f"result-{backend}.json")
+            cmd = [sys.executable, os.path.abspath(__file__), "sweep", "--output", out,
+                   "--max-cases", str(args.max_cases), "--modes", *args.modes]
+            env = dict(os.environ, DATA_POLL_SECONDS="0", QUERY_BACKEND=backend)
+            subprocess.run(cmd, cwd=workdir, env=env, check=True)
+            with open(out) as f:
+                results[backend] = json.load(f)
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def cmd_run(args):
+    import dash
+    import plotly
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "plotly": plotly.__version__,
+            "dash": dash.__version__,
+            "max_cases": args.max_cases,
+            "backends": args.backends,
+        },
+        "scales": {},
+    }
+    for scale in args.scale:
+        print(f"scale {scale}x", file=sys.stderr)
+        report["scales"][str(scale)] = run_scale(scale, args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}", file=sys.stderr)
+
+
+def cmd_sweep(args):
+    # Runs inside the data directory prepared by run_scale
+    sys.path.insert(0, HERE)
+    import Oct9P2
+
+    dataset = Oct9P2.datasets.current
+    result = {
+        "backend": Oct9P2.query_backend,
+        "rows": dataset.queries.row_counts(),
+        "results": sweep(Oct9P2, args.max_cases, args.modes),
+    }
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+
+# Chart builder -> the callback whose cases it is timed on
+figure_builders = {
+    "density_figure": "update_density_map",
+    "career_figure": "update_career_chart",
+    "skills_figure": "update_skills_chart",
+}
+
+
+def cmd_figures(args):
+    """
+    Microbenchmark of the figure builders on the go path (figures.py) against
+    the plotly.express reference (figures.px_*), uncached, on the same cases;
+    also checks that both paths produce the same figure JSON.
+    """
+    sys.path.insert(0, HERE)
+    import plotly.io as pio
+
+    import Oct9P2
+    import figures
+
+    dataset = Oct9P2.datasets.current
+    cases = benchmark_cases(dataset, args.max_cases)
+    paths = {
+        "go": {name: getattr(figures, name) for name in ("grouped_bars", "choropleth", "no_data_bars")},
+        "px": {"grouped_bars": figures.px_grouped_bars, "choropleth": figures.px_choropleth,
+               "no_data_bars": figures.px_no_data_bars},
+    }
+    report = {}
+    print(f"{'builder':16s} {'path':4s} {'p50_ms':>8s} {'p95_ms':>8s} {'calls':>6s}")
+    for builder_name, callback in figure_builders.items():
+        build = getattr(Oct9P2, builder_name).__wrapped__
+        outputs = {}
+        for path, functions in paths.items():
+            saved = {name: getattr(figures, name) for name in functions}
+            for name, function in functions.items():
+                setattr(figures, name, function)
+            try:
+                latencies, outputs[path] = [], []
+                for case in cases[callback]:
+                    start = time.perf_counter()
+                    fig = build(*case[:3], dataset=dataset)
+                    latencies.append(time.perf_counter() - start)
+                    outputs[path].append(json.loads(pio.to_json(fig, validate=False)))
+            finally:
+                for name, function in saved.items():
+                    setattr(figures, name, function)
+            ms = np.asarray(latencies) * 1000
+            report.setdefault(builder_name, {})[path] = {
+                "calls": len(ms), "p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            }
+            print(f"{builder_name:16s} {path:4s} {np.percentile(ms, 50):8.2f} {np.percentile(ms, 95):8.2f} "
+                  f"{len(ms):6d}")
+        same = sum(a == b for a, b in zip(outputs["go"], outputs["px"]))
+        report[builder_name]["identical"] = same
+        print(f"{builder_name:16s} speedup (p50) "
+              f"{report[builder_name]['px']['p50_ms'] / report[builder_name]['go']['p50_ms']:.1f}x, "
+              f"identical output {same}/{len(outputs['go'])}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def backend_runs(run):
+    """{backend: sweep result} for one scale; files from before the backend split hold a single
+    in-memory sweep."""
+    return {"memory": run} if "results" in run else run
+
+
+def cmd_compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"{'scale':>5s} {'backend':7s} {'mode':6s} {'callback':24s} {'metric':>18s} "
+          f"{'old':>10s} {'new':>10s} {'change':>8s}")
+    for scale, runs in new["scales"].items():
+        old_runs = backend_runs(old["scales"].get(scale, {}))
+        for backend, run in backend_runs(runs).items():
+            for mode, callbacks in run["results"].items():
+                for name, stats in callbacks.items():
+                    before = old_runs.get(backend, {}).get("results", {}).get(mode, {}).get(name)
+                    if before is None:
+                        continue
+                    for metric in ("p50_ms", "p95_ms", "p99_ms", "payload_bytes_mean", "wire_bytes_mean",
+                                   "peak_traced_bytes"):
+                        if metric not in before or metric not in stats:
+                            continue
+                        a, b = before[metric], stats[metric]
+                        change = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+                        print(f"{scale:>5s} {backend:7s} {mode:6s} {name:24s} {metric:>18s} "
+                              f"{a:10.2f} {b:10.2f} {change:>8s}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard callbacks without a browser.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="benchmark every callback at one or more data scales")
+    run.add_argument("--scale", type=int, nargs="+", default=[1], help="row multipliers (default: 1)")
+    run.add_argument("--output", default="bench.json")
+    run.add_argument("--max-cases", type=int, default=2000,
+                     help="sample at most this many cases per callback (0 = all; default: %(default)s)")
+    run.add_argument("--modes", nargs="+", choices=["direct", "http"], default=["direct", "http"])
+    run.add_argument("--backends", nargs="+", choices=["memory", "sqlite"], default=["memory", "sqlite"],
+                     help="query backends to compare (default: both)")
+    run.set_defaults(func=cmd_run)
+
+    sweep_parser = sub.add_parser("sweep", help=argparse.SUPPRESS)
+    sweep_parser.add_argument("--output", required=True)
+    sweep_parser.add_argument("--max-cases", type=int, default=2000)
+    sweep_parser.add_argument("--modes", nargs="+", default=["direct", "http"])
+    sweep_parser.set_defaults(func=cmd_sweep)
+
+    compare = sub.add_parser("compare", help="print the change between two benchmark JSON files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.set_defaults(func=cmd_compare)
+
+    figs = sub.add_parser("figures", help="time the go figure builders against the plotly.express reference")
+    figs.add_argument("--max-cases", type=int, default=200,
+                      help="sample at most this many cases per chart (0 = all; default: %(default)s)")
+    figs.add_argument("--output", help="also write the timings as JSON")
+    figs.set_defaults(func=cmd_figures)
+
+    synth = sub.add_parser("synth", help="write scaled-up copies of the CSVs")
+    synth.add_argument("--scale", type=int, required=True)
+    synth.add_argument("--dest", required=True)
+    synth.set_defaults(func=lambda a: print(synthesise(a.scale, a.dest)))
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Response compression and conditional callback responses for the Flask server.
+
+init_app(server) adds an after_request hook that
+
+- gives every /_dash-update-component response an ETag (a hash of its body,
+  suffixed with the content coding it is sent in, so each representation has
+  its own strong validator) and answers a matching If-None-Match with an
+  empty 304; browsers never revalidate POSTs themselves, so
+  assets/callback_etag.js remembers recent responses and sends the header;
+- compresses text responses of at least COMPRESS_MIN_BYTES with brotli when
+  the client accepts it and the optional brotli package is installed,
+  otherwise with gzip (GZIP_LEVEL, BROTLI_QUALITY).
+"""
+import gzip
+import hashlib
+import os
+
+import flask
+
+try:
+    import brotli
+except ImportError:     # optional: pip install brotli
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 5))
+
+compressible_types = {"application/json", "application/javascript", "text/javascript", "text/html",
+                      "text/css", "text/plain", "image/svg+xml"}
+
+
+def encodings():
+    """Content codings this server can produce, best first."""
+    return (["br"] if brotli is not None else []) + ["gzip"]
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def choose_encoding(request):
+    for encoding in encodings():
+        if encoding in request.accept_encodings:
+            return encoding
+    return None
+
+
+def compressible(response):
+    return (response.status_code == 200 and not response.direct_passthrough
+            and "Content-Encoding" not in response.headers
+            and response.mimetype in compressible_types)
+
+
+def response_encoding(response, request):
+    """The content coding compress_response gives the response (None: sent as is)."""
+    if not compressible(response) or len(response.get_data()) < COMPRESS_MIN_BYTES:
+        return None
+    return choose_encoding(request)
+
+
+def conditional_callback_response(response, request):
+    """ETag a callback response by content and coding; an empty 304 when the client already holds it."""
+    if not request.path.endswith("/_dash-update-component") or response.status_code != 200:
+        return response
+    etag = hashlib.sha1(response.get_data()).hexdigest()[:20]
+    encoding = response_encoding(response, request)
+    if encoding is not None:
+        etag = f"{etag}-{encoding}"
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = "no-cache"
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        response.set_data(b"")
+    return response
+
+
+def compress_response(response, request):
+    if not compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = response_encoding(response, request)
+    if encoding is None:
+        return response
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(server):
+    @server.after_request
+    def compress_and_tag(response):
+        response = conditional_callback_response(response, flask.request)
+        return compress_response(response, flask.request)
+    return server
@@ -0,0 +1,612 @@
+"""
+Loading of the dashboard data files and the indexes derived from them.
+
+A Dataset is one immutable version of the four CSVs plus everything computed
+from them. DatasetManager keeps the current Dataset, polls the files' mtimes
+and swaps in a freshly loaded and validated version in the background;
+callbacks read `datasets.current` once, so in-flight requests finish on the
+version they started with.
+
+Loaded tables are coerced to `schema` (names categorical, numbers numeric),
+and the name filtering and per-state sorting the charts need is done once
+per version in the indexes below, so callbacks only index into them.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from snapshot import SNAPSHOT_DIR, TABLES as data_files, load_table, read_index_store, write_index_store
+
+logger = logging.getLogger(__name__)
+
+state_abbrev = {
+    "Alabama": "AL","Alaska": "AK","Arizona": "AZ","Arkansas": "AR","California": "CA",
+    "Colorado": "CO","Connecticut": "CT","Delaware": "DE","Florida": "FL","Georgia": "GA",
+    "Hawaii": "HI","Idaho": "ID","Illinois": "IL","Indiana": "IN","Iowa": "IA",
+    "Kansas": "KS","Kentucky": "KY","Louisiana": "LA","Maine": "ME","Maryland": "MD",
+    "Massachusetts": "MA","Michigan": "MI","Minnesota": "MN","Mississippi": "MS",
+    "Missouri": "MO","Montana": "MT","Nebraska": "NE","Nevada": "NV","New Hampshire": "NH",
+    "New Jersey": "NJ","New Mexico": "NM","New York": "NY","North Carolina": "NC",
+    "North Dakota": "ND","Ohio": "OH","Oklahoma": "OK","Oregon": "OR","Pennsylvania": "PA",
+    "Rhode Island": "RI","South Carolina": "SC","South Dakota": "SD","Tennessee": "TN",
+    "Texas": "TX","Utah": "UT","Vermont": "VT","Virginia": "VA","Washington": "WA",
+    "West Virginia": "WV","Wisconsin": "WI","Wyoming": "WY","Washington, D.C.": "DC"
+}
+
+# The whole country as a comparison chart reference or compared "state": skills are summed
+# over every state, career values averaged over the states (missing values counting as 0)
+national = "United States"
+
+# Names treated as "no real category" and excluded from the bar charts
+bad_names = {"other", "other/unknown", "other / unknown", "unknown", "misc", "other, misc"}
+
+# Columns each file must provide and the type they are coerced to on load:
+# "name" columns become categoricals, "number" columns floats or ints (unparseable values NaN)
+schema = {
+    "DensityMapDataV3.csv": {"state_name": "name", "year": "number", "ai_jobs_count": "number",
+                             "all_jobs_state_year": "number"},
+    "TopAISkillsChartData_CareerArea.csv": {"state_name": "name", "lot_career_area_name": "name",
+                                            "skills_name": "name", "skill_count": "number",
+                                            "total_ai_listings": "number"},
+    "TopAICareerDataV2_with_other.csv": {"state_name": "name", "lot_career_area_name": "name",
+                                         "proportion": "number"},
+    "CareerAreaIntensity.csv": {"state_name": "name", "lot_career_area_name": "name", "intensity": "number"},
+}
+required_columns = {path: list(columns) for path, columns in schema.items()}
+
+# Optional FIPS-keyed density tables (one row per region and year); "code" columns become
+# zero-padded 5-digit strings
+region_schema = {"fips": "code", "region_name": "name", "year": "number", "ai_jobs_count": "number",
+                 "all_jobs_region_year": "number"}
+
+# Density map levels: the state table, and region tables keyed by FIPS code with their boundary
+# GeoJSON (see geometry.py). A region level is offered only when both of its files exist.
+# key: the column areas are grouped by; name / code: hover label and map location columns.
+geo_dir = os.environ.get("GEO_DIR", "geo")
+density_levels = {
+    "state": {"table": "DensityMapDataV3.csv", "key": "state_name", "name": "state_name",
+              "code": "state_abbrev", "total": "all_jobs_state_year", "label": "state"},
+    "county": {"table": "DensityMapCountyData.csv", "geometry": os.path.join(geo_dir, "counties.geojson"),
+               "key": "fips", "name": "region_name", "code": "fips", "total": "all_jobs_region_year",
+               "label": "county"},
+    "metro": {"table": "DensityMapMetroData.csv", "geometry": os.path.join(geo_dir, "metros.geojson"),
+              "key": "fips", "name": "region_name", "code": "fips", "total": "all_jobs_region_year",
+              "label": "metro area"},
+}
+
+# How many years past the last year of data the density trends are projected
+trend_forecast_years = int(os.environ.get("TREND_FORECAST_YEARS", 2))
+
+
+def region_levels():
+    """The region density levels whose table and geometry files are both present."""
+    return [level for level, spec in density_levels.items()
+            if "geometry" in spec and os.path.exists(spec["table"]) and os.path.exists(spec["geometry"])]
+
+
+def data_paths():
+    """Every file a Dataset is built from: the four tables plus the present region tables and geometry."""
+    paths = list(data_files)
+    for level in region_levels():
+        paths += [density_levels[level]["table"], density_levels[level]["geometry"]]
+    return paths
+
+
+def dataset_version(paths=None):
+    """Short stamp of the data files' names, sizes and mtimes; changes whenever any file is replaced."""
+    h = hashlib.sha1()
+    for path in paths or data_paths():
+        st = os.stat(path)
+        h.update(f"{path}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()[:12]
+
+
+# =========================
+# Typed tables
+# =========================
+def fips_codes(column):
+    """FIPS codes as zero-padded 5-digit strings (CSV readers turn 01001 into the number 1001)."""
+    if pd.api.types.is_numeric_dtype(column):
+        column = column.astype("Int64")
+    return column.astype("string").str.strip().str.zfill(5)
+
+
+def normalise_table(df, columns):
+    """Coerce a loaded table's schema columns in place to their declared types."""
+    for name, kind in columns.items():
+        col = df[name]
+        if kind == "name" and not isinstance(col.dtype, pd.CategoricalDtype):
+            df[name] = col.astype("category")
+        elif kind == "number" and not pd.api.types.is_numeric_dtype(col):
+            df[name] = pd.to_numeric(col, errors="coerce")
+        elif kind == "code":
+            df[name] = fips_codes(col).astype("category")
+    return df
+
+
+def bad_name_mask(column):
+    """Boolean mask of the rows of a categorical column whose name is in bad_names (missing names are kept)."""
+    categories = column.cat.categories
+    bad = np.asarray(categories.astype(str).str.strip().str.lower().isin(bad_names), dtype=bool)
+    # Code -1 (missing) indexes the trailing False
+    return np.append(bad, False)[column.cat.codes.to_numpy()]
+
+
+# =========================
+# Precomputed indexes
+# =========================
+def build_career_index(df, ycol, fill=None):
+    """
+    Per state, the career areas (file order, bad names dropped) with their
+    metric value in %, and the order that presorts them largest first (missing
+    values last, ties in file order): {state: (areas, values, order)}.
+    """
+    df = df[~bad_name_mask(df["lot_career_area_name"])]
+    values = df[ycol] if fill is None else df[ycol].fillna(fill)
+    values = values.to_numpy(dtype=float) * 100
+    areas = df["lot_career_area_name"].to_numpy(dtype=object)
+    index = {}
+    for state, rows in df.groupby("state_name", observed=True, sort=False).indices.items():
+        state_values = values[rows]
+        index[state] = (areas[rows], state_values, np.argsort(-state_values, kind="stable"))
+    return index
+
+
+def name_key(name):
+    """A career area name as a dict key: missing names (NaN) become None."""
+    return name if isinstance(name, str) else None
+
+
+def build_career_matrix(df, ycol, fill=None):
+    """
+    The career table as one dense state x career area matrix of values (%), NaN
+    where a state has no value (a state's first row wins for a repeated area),
+    so any states can be aligned to any areas in one lookup. Row `national`
+    holds the mean over states; a trailing all-NaN row and column stand in for
+    unknown states and areas (index -1). "national" is that row as a
+    career index entry (areas in file order, presorted largest first).
+    """
+    df = df[~bad_name_mask(df["lot_career_area_name"]) & df["state_name"].notna().to_numpy()]
+    values = df[ycol] if fill is None else df[ycol].fillna(fill)
+    values = values.to_numpy(dtype=float) * 100
+    state_codes, states = pd.factorize(df["state_name"], sort=True)
+    area_codes, areas = pd.factorize(df["lot_career_area_name"].astype(object), use_na_sentinel=False)
+    n_states, n_areas = len(states), len(areas)
+
+    _, first = np.unique(state_codes * n_areas + area_codes, return_index=True)
+    grid = np.full((n_states + 2, n_areas + 1), np.nan)
+    grid[state_codes[first], area_codes[first]] = values[first]
+    national_values = np.nan_to_num(grid[:n_states, :n_areas]).mean(axis=0) if n_states else np.zeros(n_areas)
+    grid[n_states, :n_areas] = national_values
+
+    areas = np.asarray(areas, dtype=object)
+    state_index = {s: i for i, s in enumerate(states)}
+    state_index[national] = n_states
+    return {
+        "state_index": state_index,
+        "area_index": {name_key(a): i for i, a in enumerate(areas)},
+        "values": grid,
+        "national": (areas, national_values, np.argsort(-national_values, kind="stable")),
+    }
+
+
+def build_skills_cube(df):
+    """
+    Index the skills table once as a sparse state x career area x skill cube:
+    one entry per skill a (state, career area) pair mentions, sorted by pair
+    and skill, with the entries of pair = state * areas + area at
+    offsets[pair]:offsets[pair + 1] (CSR-style). Memory grows with the rows,
+    not with states x areas x skills; a query sums the selected pairs' entries.
+    """
+    df = df[~bad_name_mask(df["skills_name"])]
+    skill_count = df["skill_count"].fillna(0).to_numpy(dtype=float)
+    total_ai_listings = df["total_ai_listings"].fillna(0).to_numpy(dtype=float)
+
+    # A missing career area is an area of its own (key None), as in the career matrix and in SQL
+    state_codes, states = pd.factorize(df["state_name"], sort=True)
+    area_codes, areas = pd.factorize(df["lot_career_area_name"].astype(object), sort=True, use_na_sentinel=False)
+    skill_codes, skills = pd.factorize(df["skills_name"], sort=True)
+    # Rows without a state belong to no state (nor to the national total); rows without a
+    # skill still count towards their career area's listings
+    known = state_codes >= 0
+    state_codes, area_codes, skill_codes = state_codes[known], area_codes[known], skill_codes[known]
+    skill_count, total_ai_listings = skill_count[known], total_ai_listings[known]
+    n_states, n_areas, n_skills = len(states), len(areas), max(len(skills), 1)
+
+    # Every row counted once under its state and once more under a last row for the whole country
+    named = skill_codes >= 0
+    pairs = (state_codes * n_areas + area_codes)[named]
+    pairs = np.concatenate([pairs, n_states * n_areas + area_codes[named]]).astype(np.int64)
+    entries, inverse = np.unique(pairs * n_skills + np.tile(skill_codes[named], 2), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.tile(skill_count[named], 2), minlength=len(entries))
+    offsets = np.searchsorted(entries // n_skills, np.arange((n_states + 1) * n_areas + 1))
+
+    # Each (state, career area) has one total_ai_listings value, repeated for every skill.
+    # Deduplicate by (state, career, total) before summing, as the per-request code did.
+    totals = pd.DataFrame({"s": state_codes, "a": area_codes, "t": total_ai_listings}).drop_duplicates()
+    denominators = np.zeros((n_states, n_areas))
+    np.add.at(denominators, (totals["s"].to_numpy(), totals["a"].to_numpy()), totals["t"].to_numpy())
+    denominators = np.concatenate([denominators, denominators.sum(axis=0, keepdims=True)])
+    state_index = {s: i for i, s in enumerate(states)}
+    state_index[national] = n_states
+
+    return {
+        "state_index": state_index,
+        "area_index": {name_key(a): i for i, a in enumerate(areas)},
+        "skills": np.asarray(skills, dtype=object),
+        "offsets": offsets,
+        "skill_codes": (entries % n_skills).astype(np.int32),
+        "counts": counts,
+        "denominators": denominators,
+    }
+
+
+def cube_entries(cube, rows, areas):
+    """The entries of every (row, area) pair of the skills cube, and the position in rows each belongs to."""
+    pairs = (np.asarray(rows)[:, None] * len(cube["area_index"]) + np.asarray(areas)[None, :]).ravel()
+    starts = cube["offsets"][pairs]
+    lengths = cube["offsets"][pairs + 1] - starts
+    entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    owners = np.repeat(np.arange(len(rows)).repeat(len(areas)), lengths)
+    return entries, owners
+
+
+def query_skills_cube(cube, state, area_mask):
+    """Return (skill_count, denominator, proportion %, present) over the selected career areas."""
+    i = cube["state_index"][state]
+    entries, _ = cube_entries(cube, [i], np.flatnonzero(area_mask))
+    skill_codes = cube["skill_codes"][entries]
+    # (np.bincount returns ints when there is nothing to count)
+    counts = np.bincount(skill_codes, weights=cube["counts"][entries], minlength=len(cube["skills"])).astype(float)
+    present = np.bincount(skill_codes, minlength=len(cube["skills"])) > 0
+    denominator = cube["denominators"][i][area_mask].sum()
+    proportion = counts / denominator * 100 if denominator > 0 else np.zeros_like(counts)
+    return counts, denominator, proportion, present
+
+
+def query_skills_cube_states(cube, states, area_mask, skill_columns):
+    """
+    (skill_count, denominators, proportion %, present) of several states (rows)
+    for the given skill columns over the selected career areas, in one lookup;
+    unknown states are all zero.
+    """
+    known = np.asarray([s in cube["state_index"] for s in states], dtype=bool)
+    rows = np.asarray([cube["state_index"].get(s, 0) for s in states], dtype=int)
+    areas = np.flatnonzero(area_mask)
+    entries, owners = cube_entries(cube, rows, areas)
+    n_skills = len(cube["skills"])
+    cells = owners * n_skills + cube["skill_codes"][entries]
+    shape = (len(rows), n_skills)
+    columns = np.asarray(skill_columns, dtype=int)
+    counts = np.bincount(cells, weights=cube["counts"][entries], minlength=shape[0] * shape[1]).reshape(shape)
+    counts = counts[:, columns].astype(float) * known[:, None]
+    present = (np.bincount(cells, minlength=shape[0] * shape[1]).reshape(shape)[:, columns] > 0) & known[:, None]
+    denominators = cube["denominators"][np.ix_(rows, areas)].sum(axis=1) * known
+    proportion = np.divide(counts, denominators[:, None], out=np.zeros_like(counts),
+                           where=denominators[:, None] > 0) * 100
+    return counts, denominators, proportion, present
+
+
+def top_n(values, candidates, n=10):
+    """Indices of the n largest values among candidates, largest first (ties keep index order)."""
+    candidates = np.flatnonzero(candidates)
+    # A full stable sort rather than argpartition, which picks arbitrarily among values tied at the cut
+    return candidates[np.argsort(-values[candidates], kind="stable")[:n]]
+
+
+def build_density_index(df, key="state_name", name="state_name", code="state_abbrev",
+                        total="all_jobs_state_year"):
+    """
+    Cumulative per-area sums of ai_jobs_count and the area's total jobs over
+    the sorted year axis, so any year range is two lookups per area. Areas are
+    the distinct `key` values, sorted (states by name, regions by FIPS code),
+    each with its first name and code.
+    """
+    df = df.dropna(subset=[name, code, "year"])
+    area_codes, areas = pd.factorize(df[key], sort=True)
+    year_codes, years = pd.factorize(df["year"], sort=True)
+    shape = (len(areas), len(years))
+
+    def cumulative(values):
+        grid = np.zeros(shape)
+        np.add.at(grid, (area_codes, year_codes), values)
+        # Leading zero column so a range is cum[:, hi] - cum[:, lo]
+        return np.concatenate([np.zeros((shape[0], 1)), grid.cumsum(axis=1)], axis=1)
+
+    firsts = df.drop_duplicates(key).set_index(key)
+
+    def per_area(column):
+        if column == key:
+            return np.asarray(areas, dtype=object)
+        return firsts[column].reindex(areas).to_numpy(dtype=object)
+
+    return {
+        "years": np.asarray(years),
+        "names": per_area(name),
+        "codes": per_area(code),
+        "ai_jobs_count": cumulative(df["ai_jobs_count"].to_numpy(dtype=float)),
+        "all_jobs": cumulative(df[total].to_numpy(dtype=float)),
+        "rows": cumulative(np.ones(len(df))),
+    }
+
+
+def query_density_index(index, start_year, end_year):
+    """Per-area (ai_jobs_count, total jobs, has_rows) summed over [start_year, end_year]."""
+    lo = np.searchsorted(index["years"], start_year, side="left")
+    hi = np.searchsorted(index["years"], end_year, side="right")
+    ai_jobs = index["ai_jobs_count"][:, hi] - index["ai_jobs_count"][:, lo]
+    all_jobs = index["all_jobs"][:, hi] - index["all_jobs"][:, lo]
+    has_rows = index["rows"][:, hi] > index["rows"][:, lo]
+    return ai_jobs, all_jobs, has_rows
+
+
+def fit_density_trends(queries, horizon=trend_forecast_years, level="state"):
+    """
+    Least-squares line through each area's yearly AI share of its jobs
+    (ai_jobs_count / total jobs, %), fitted for every area of the level at
+    once from sums over the area x year grid. Years without rows (or jobs) are
+    left out of an area's fit; areas with fewer than two such years are
+    dropped. Returns per-area arrays: name, code, slope (percentage points
+    per year), latest share and its year, and the fitted share `horizon`
+    years after the last year of data (floored at 0), plus that forecast year.
+    """
+    years = np.asarray(queries.density_years(level), dtype=float)
+    per_year = []
+    for column, year in enumerate(years):
+        names, codes, ai_jobs, all_jobs = queries.density_totals(int(year), int(year), level)
+        jobs = all_jobs > 0
+        per_year.append(pd.DataFrame({"name": names[jobs], "code": codes[jobs], "column": column,
+                                      "share": ai_jobs[jobs] / all_jobs[jobs] * 100}))
+    cells = pd.concat(per_year, ignore_index=True) if per_year else pd.DataFrame(
+        {"name": [], "code": [], "column": [], "share": []})
+    # Areas are identified by code for regions and by name for states, as in the density index
+    key = "name" if density_levels[level]["key"] == density_levels[level]["name"] else "code"
+    rows, areas = pd.factorize(cells[key])
+    firsts = cells.drop_duplicates(key).set_index(key, drop=False).reindex(areas)
+
+    grid = np.full((len(areas), len(years)), np.nan)
+    grid[rows, cells["column"].to_numpy(dtype=int)] = cells["share"].to_numpy(dtype=float)
+    observed = ~np.isnan(grid)
+    weight = observed.astype(float)
+    share = np.where(observed, grid, 0.0)
+
+    # Years relative to the last one, so the intercept is the fitted latest share
+    t = years - years[-1] if len(years) else years
+    n, st, stt = weight.sum(axis=1), weight @ t, weight @ (t * t)
+    sy, sty = share.sum(axis=1), share @ t
+    denom = n * stt - st * st
+    fitted = (n >= 2) & (denom > 0)
+    safe_denom = np.where(fitted, denom, 1.0)
+    slope = (n * sty - st * sy) / safe_denom
+    intercept = (sy - slope * st) / np.where(fitted, n, 1.0)
+
+    last = observed.shape[1] - 1 - np.argmax(observed[:, ::-1], axis=1)
+    latest = grid[np.arange(len(areas)), last] if len(areas) else np.zeros(0)
+    return {
+        "names": firsts["name"].to_numpy(dtype=object)[fitted],
+        "codes": firsts["code"].to_numpy(dtype=object)[fitted],
+        "slope": slope[fitted],
+        "latest": latest[fitted],
+        "latest_year": years[last][fitted] if len(years) else np.zeros(0),
+        "forecast": np.maximum(intercept + slope * horizon, 0.0)[fitted],
+        "forecast_year": int(years[-1]) + horizon if len(years) else None,
+    }
+
+
+# =========================
+# Dataset versions
+# =========================
+def build_indexes(tables):
+    """The indexes the memory backend queries, built from the loaded tables."""
+    career_index = {
+        "share": build_career_index(tables["TopAICareerDataV2_with_other.csv"], "proportion"),
+        "intensity": build_career_index(tables["CareerAreaIntensity.csv"], "intensity", fill=0),
+    }
+    career_matrix = {
+        "share": build_career_matrix(tables["TopAICareerDataV2_with_other.csv"], "proportion"),
+        "intensity": build_career_matrix(tables["CareerAreaIntensity.csv"], "intensity", fill=0),
+    }
+    for metric, matrix in career_matrix.items():
+        career_index[metric][national] = matrix["national"]
+    return {
+        "skills_cube": build_skills_cube(tables["TopAISkillsChartData_CareerArea.csv"]),
+        "career_index": career_index,
+        "career_matrix": career_matrix,
+        "density_index": build_density_index(tables["DensityMapDataV3.csv"]),
+        "region_index": {
+            level: build_density_index(tables[density_levels[level]["table"]], **{
+                column: density_levels[level][column] for column in ("key", "name", "code", "total")})
+            for level in density_levels if level != "state" and density_levels[level]["table"] in tables
+        },
+    }
+
+
+class Dataset:
+    """
+    One loaded version of the data files and the indexes built from them;
+    read-only once built. The charts query it through `queries` (see query.py):
+    in memory when built from tables, or through an SQL backend whose tables
+    stay on disk (the pandas attributes are then None).
+
+    Region density levels (county, metro) present in the tables get their
+    simplified boundaries prepared once (geometry.py): `geometry` maps each to
+    the file name the map figures reference.
+    """
+
+    def __init__(self, version, tables=None, queries=None, snapshot_dir=None):
+        self.version = version
+        if tables is None:
+            self.density_map_data = self.top_ai_skills_data = None
+            self.top_ai_career_data = self.career_intensity_data = None
+            self.skills_cube = self.density_index = self.career_index = self.career_matrix = None
+            self.region_index = None
+            self.queries = queries
+            self.finish()
+            return
+
+        from query import MemoryQueries
+
+        self.density_map_data = tables["DensityMapDataV3.csv"]
+        self.top_ai_skills_data = tables["TopAISkillsChartData_CareerArea.csv"]
+        self.top_ai_career_data = tables["TopAICareerDataV2_with_other.csv"]   # for share
+        self.career_intensity_data = tables["CareerAreaIntensity.csv"]         # for intensity
+
+        if "state_abbrev" not in self.density_map_data.columns:
+            self.density_map_data["state_abbrev"] = self.density_map_data["state_name"].map(state_abbrev)
+
+        # With a snapshot_dir the indexes come from (or go to) its per-version store, memory-mapped
+        # and so shared by every worker on the host (see snapshot.py)
+        indexes = read_index_store(version, snapshot_dir) if snapshot_dir else None
+        if indexes is None:
+            indexes = build_indexes(tables)
+            if snapshot_dir:
+                try:
+                    write_index_store(version, indexes, snapshot_dir)
+                    indexes = read_index_store(version, snapshot_dir) or indexes
+                except OSError:
+                    pass    # read-only checkout: keep this process's copy
+        self.skills_cube = indexes["skills_cube"]
+        self.career_index = indexes["career_index"]
+        self.career_matrix = indexes["career_matrix"]
+        self.density_index = indexes["density_index"]
+        self.region_index = indexes["region_index"]
+        self.queries = MemoryQueries(self)
+        self.finish()
+
+    def finish(self):
+        """Options, per-level trend fits and region geometry, the same for every backend."""
+        import geometry
+
+        self.options = self.queries.options()
+        self.density_trends = {level: fit_density_trends(self.queries, level=level)
+                               for level in self.options["density_levels"]}
+        self.geometry = {level: geometry.prepare(density_levels[level]["geometry"])
+                         for level in self.options["density_levels"] if level != "state"}
+
+
+def validate_tables(tables):
+    for path, columns in table_schemas(tables).items():
+        df = tables[path]
+        missing = [c for c in columns if c not in df.columns]
+        if missing:
+            raise ValueError(f"{path}: missing columns {missing}")
+        if df.empty:
+            raise ValueError(f"{path}: no rows")
+        normalise_table(df, columns)
+
+
+def table_schemas(paths):
+    """The schema of each data table among paths (the four tables and any region tables)."""
+    region_tables = {density_levels[level]["table"] for level in density_levels if level != "state"}
+    return {path: schema.get(path, region_schema) for path in paths
+            if path in schema or path in region_tables}
+
+
+def load_dataset(mmap=False, backend="memory", snapshot_dir=SNAPSHOT_DIR):
+    """
+    Load and validate all data files as a Dataset. Retries if a file changes
+    while it is being read, so the version stamp always matches the contents.
+
+    mmap=True memory-maps the snapshot columns and the stored indexes (see
+    snapshot.py), so processes loading the same version share them.
+
+    backend="sqlite" builds (once per version) and queries an on-disk SQLite
+    copy instead of loading the tables into memory.
+    """
+    if backend == "sqlite":
+        from query import SQLiteQueries, build_database, database_path
+
+        while True:
+            paths = data_paths()
+            version = dataset_version(paths)
+            tables = table_schemas(paths)
+            path = build_database(version, list(tables), {table: list(columns) for table, columns in tables.items()},
+                                  snapshot_dir)
+            if dataset_version() == version:
+                break
+            os.remove(database_path(version, snapshot_dir))
+        return Dataset(version, queries=SQLiteQueries(path))
+
+    while True:
+        paths = data_paths()
+        version = dataset_version(paths)
+        tables = {path: load_table(path, snapshot_dir, mmap=mmap) for path in table_schemas(paths)}
+        if dataset_version() == version:
+            break
+    validate_tables(tables)
+    return Dataset(version, tables, snapshot_dir=snapshot_dir if mmap else None)
+
+
+class DatasetManager:
+    """
+    Holds the current Dataset and hot-swaps a new one when the data files change.
+    Listeners registered with on_swap run after each swap (e.g. to drop caches).
+    A version that fails to load is retried after retry_seconds, doubling after
+    each further failure up to max_retry_seconds, so a half-written file or a
+    snapshot another worker is still rebuilding is picked up once it settles.
+    """
+
+    def __init__(self, loader, poll_seconds=30, retry_seconds=30, max_retry_seconds=1800):
+        self.loader = loader
+        self.poll_seconds = poll_seconds
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.current = loader()
+        self._listeners = []
+        self._failed = None     # (version, monotonic time of the last failure, failures so far)
+        self._lock = threading.Lock()
+        self._poller_pid = None
+
+    def on_swap(self, listener):
+        self._listeners.append(listener)
+        return listener
+
+    def check(self):
+        """Reload if the files changed since the current version. Returns True if a new version was swapped in."""
+        with self._lock:
+            version = dataset_version()
+            if version == self.current.version:
+                return False
+            failures = 0
+            if self._failed is not None and self._failed[0] == version:
+                _, failed_at, failures = self._failed
+                if time.monotonic() - failed_at < self.retry_delay(failures):
+                    return False
+            try:
+                dataset = self.loader()
+            except Exception:
+                # Half-written or malformed publish: keep serving the old version and try again later
+                self._failed = (version, time.monotonic(), failures + 1)
+                logger.exception("Failed to load data version %s; keeping %s, retrying in %.0fs",
+                                 version, self.current.version, self.retry_delay(failures + 1))
+                return False
+            self._failed = None
+            old, self.current = self.current, dataset
+            logger.info("Swapped data version %s -> %s", old.version, dataset.version)
+        for listener in self._listeners:
+            listener(dataset)
+        return True
+
+    def retry_delay(self, failures):
+        """Seconds to wait before loading a version again after it failed `failures` times in a row."""
+        return min(self.retry_seconds * 2 ** min(failures - 1, 20), self.max_retry_seconds)
+
+    def start(self):
+        """Start the mtime poller in this process (idempotent; safe to call after a fork)."""
+        if self.poll_seconds <= 0 or self._poller_pid == os.getpid():
+            return
+        self._poller_pid = os.getpid()
+        threading.Thread(target=self._poll, name="dataset-poller", daemon=True).start()
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Data file poll failed")
@@ -0,0 +1,214 @@
+"""
+Figure builders for the dashboard charts.
+
+The charts used to be drawn with plotly.express and then restyled, which
+reshapes a DataFrame, groups it and validates every property on each call.
+The builders here produce the same figures (identical JSON) directly from
+NumPy arrays with go.Bar / go.Choropleth on prebuilt shared layouts, with
+validation skipped: every value passed in is one the chart code produces,
+of a type plotly accepts as is.
+
+The px_* functions are the plotly.express versions they replace, kept as the
+reference for `python benchmark.py figures`, which times both paths and
+checks that their output matches.
+"""
+import numpy as np
+import pandas as pd
+import plotly.colors
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+
+# Colors / Style
+orange = "#FF8200"
+gray = "#4B4B4B"
+light_gray = "#d3d3d3"
+dark_gray = "#2f2f2f"
+font = {"color": "white", "family": "Gotham, sans-serif"}
+# Compared states when there are several
+palette = plotly.colors.qualitative.Dark24
+
+# Layout every chart starts from: plotly express's default template plus the dashboard styling
+_base_layouts = {}
+
+
+def base_layout(kind):
+    """The shared layout for "bar", "empty" (no data), "map" or "trend_map" figures, built on first use."""
+    layout = _base_layouts.get(kind)
+    if layout is None:
+        template = pio.templates[pio.templates.default]
+        if kind == "trend_map":
+            # Diverging scale centred on no change: red for falling shares, blue for rising
+            layout = dict(base_layout("map"), coloraxis={
+                "colorbar": {"title": {"text": "pp / year"}},
+                "colorscale": plotly.colors.make_colorscale(plotly.colors.diverging.RdBu),
+                "autocolorscale": False, "cmid": 0, "showscale": True})
+        elif kind == "map":
+            layout = {
+                "template": template,
+                "geo": {"domain": {"x": [0.0, 1.0], "y": [0.0, 1.0]}, "center": {}, "scope": "usa",
+                        "bgcolor": gray},
+                "coloraxis": {"colorbar": {"title": {"text": "value"}},
+                              "colorscale": plotly.colors.make_colorscale(plotly.colors.sequential.Blues),
+                              "autocolorscale": False, "showscale": False},
+                "legend": {"tracegroupgap": 0},
+                "margin": {"t": 30, "r": 0, "l": 0, "b": 0},
+                "font": font,
+                "paper_bgcolor": gray,
+                "plot_bgcolor": gray,
+            }
+        elif kind == "empty":
+            layout = {
+                "template": template,
+                "xaxis": {"anchor": "y", "domain": [0.0, 1.0]},
+                "yaxis": {"anchor": "x", "domain": [0.0, 1.0]},
+                "legend": {"tracegroupgap": 0},
+                "barmode": "relative",
+                "font": font,
+                "plot_bgcolor": light_gray,
+                "paper_bgcolor": gray,
+            }
+        else:
+            layout = {
+                "template": template,
+                "legend": {"title": {"text": "state_name"}, "tracegroupgap": 0},
+                "barmode": "group",
+                "font": font,
+                "margin": {"l": 10, "r": 10, "t": 50, "b": 60},
+                "plot_bgcolor": light_gray,
+                "paper_bgcolor": gray,
+            }
+        _base_layouts[kind] = layout
+    return layout
+
+
+def figure(data, layout):
+    return go.Figure(data=data, layout=layout, _validate=False)
+
+
+# =========================
+# Builders
+# =========================
+def no_data_bars(title):
+    """The empty bar chart shown when the first state has nothing to compare."""
+    trace = go.Bar(hovertemplate="<extra></extra>", legendgroup="",
+                   marker={"color": "#636efa", "pattern": {"shape": ""}}, name="", orientation="v",
+                   showlegend=False, textposition="auto", xaxis="x", yaxis="y", _validate=False)
+    return figure([trace], dict(base_layout("empty"), title={"text": title}))
+
+
+def bar_trace(name, color, x, y, hovertemplate, customdata):
+    trace = go.Bar(alignmentgroup="True", hovertemplate=hovertemplate, legendgroup=name,
+                   marker={"color": color, "pattern": {"shape": ""}}, name=name, offsetgroup=name,
+                   orientation="v", showlegend=True, textposition="auto", x=x, xaxis="x", y=y, yaxis="y",
+                   _validate=False)
+    if customdata is not None:
+        trace.customdata = customdata
+    return trace
+
+
+def compare_colors(n):
+    """Colours of n compared states: gray for one (beside the orange reference), else the palette in turn."""
+    if n == 1:
+        return [gray]
+    return [palette[i % len(palette)] for i in range(n)]
+
+
+def grouped_bars(x, reference_values, values, reference, states, title, x_title, y_title, hovertemplate,
+                 customdata=None):
+    """
+    The reference state's values and each compared state's (the rows of
+    values) side by side over the categories x (in that order). customdata,
+    when given, holds one array per trace, the reference's first.
+    """
+    x = np.asarray(x, dtype=object)
+    customdata = customdata if customdata is not None else [None] * (len(states) + 1)
+    traces = [bar_trace(reference, orange, x, reference_values, hovertemplate, customdata[0])]
+    for state, color, y, trace_customdata in zip(states, compare_colors(len(states)), values, customdata[1:]):
+        traces.append(bar_trace(state, color, x, y, hovertemplate, trace_customdata))
+    layout = dict(
+        base_layout("bar"),
+        xaxis={"anchor": "y", "domain": [0.0, 1.0], "title": {"text": x_title}, "categoryorder": "array",
+               "categoryarray": list(x)},
+        yaxis={"anchor": "x", "domain": [0.0, 1.0], "title": {"text": y_title}},
+        title={"text": title},
+    )
+    return figure(traces, layout)
+
+
+def map_locations(trace, locations, geojson):
+    """States by USPS code on plotly's own outlines, other regions by FIPS id in the geojson (a URL)."""
+    trace.locations = np.asarray(locations, dtype=object)
+    if geojson is None:
+        trace.locationmode = "USA-states"
+    else:
+        trace.geojson = geojson
+        trace.featureidkey = "id"
+        # Thin borders, or thousands of small regions blur into their outlines
+        trace.marker = {"line": {"width": 0.2}}
+    return trace
+
+
+def choropleth(locations, hovertext, z, title, geojson=None):
+    """US map coloured by z: states, or the regions of geojson."""
+    trace = go.Choropleth(coloraxis="coloraxis", geo="geo",
+                          hovertemplate="<b>%{hovertext}</b><br>%{z:.2f}%<extra></extra>",
+                          hovertext=np.asarray(hovertext, dtype=object), name="",
+                          z=np.asarray(z, dtype=float), _validate=False)
+    return figure([map_locations(trace, locations, geojson)], dict(base_layout("map"), title={"text": title}))
+
+
+def trend_choropleth(locations, hovertext, slopes, customdata, title, hovertemplate, geojson=None):
+    """US map coloured by fitted trend (slopes), with per-area customdata for the hover."""
+    trace = go.Choropleth(coloraxis="coloraxis", customdata=customdata, geo="geo", hovertemplate=hovertemplate,
+                          hovertext=np.asarray(hovertext, dtype=object), name="",
+                          z=np.asarray(slopes, dtype=float), _validate=False)
+    return figure([map_locations(trace, locations, geojson)], dict(base_layout("trend_map"), title={"text": title}))
+
+
+# =========================
+# plotly.express reference
+# =========================
+def px_no_data_bars(title):
+    fig = px.bar(title=title)
+    fig.update_layout(plot_bgcolor=light_gray, paper_bgcolor=gray, font=dict(font))
+    return fig
+
+
+def px_grouped_bars(x, reference_values, values, reference, states, title, x_title, y_title, hovertemplate,
+                    customdata=None):
+    names = [reference, *states]
+    rows = [reference_values, *values]
+    plot_df = pd.DataFrame({
+        "category": np.concatenate([np.asarray(x, dtype=object)] * len(names)),
+        "value": np.concatenate(rows) if len(x) else [],
+        "state_name": np.repeat(np.asarray(names, dtype=object), len(x)),
+    })
+    custom_data = None
+    if customdata is not None:
+        stacked = np.concatenate(customdata)
+        custom_data = [f"c{i}" for i in range(stacked.shape[1])]
+        for i, column in enumerate(custom_data):
+            plot_df[column] = stacked[:, i]
+    fig = px.bar(plot_df, x="category", y="value", color="state_name", title=title, custom_data=custom_data,
+                 labels={"category": x_title, "value": y_title}, barmode="group",
+                 color_discrete_map=dict(zip(names, [orange, *compare_colors(len(states))])))
+    fig.update_xaxes(categoryorder="array", categoryarray=list(x))
+    fig.update_traces(hovertemplate=hovertemplate)
+    fig.update_layout(plot_bgcolor=light_gray, paper_bgcolor=gray, font=dict(font),
+                      margin=dict(l=10, r=10, t=50, b=60))
+    return fig
+
+
+def px_choropleth(locations, hovertext, z, title, geojson=None):
+    df = pd.DataFrame({"state_name": hovertext, "state_abbrev": locations, "value": z})
+    where = {"locationmode": "USA-states"} if geojson is None else {"geojson": geojson, "featureidkey": "id"}
+    fig = px.choropleth(df, locations="state_abbrev", color="value", hover_name="state_name", scope="usa",
+                        color_continuous_scale="Blues", **where)
+    fig.update_traces(hovertemplate="<b>%{hovertext}</b><br>%{z:.2f}%<extra></extra>")
+    if geojson is not None:
+        fig.update_traces(marker_line_width=0.2)
+    fig.update_geos(bgcolor=gray)
+    fig.update_layout(paper_bgcolor=gray, plot_bgcolor=gray, font=dict(font), title=title,
+                      margin={"r": 0, "t": 30, "l": 0, "b": 0}, coloraxis_showscale=False)
+    return fig
@@ -0,0 +1,241 @@
+"""
+Region boundaries for the county / metro density maps.
+
+A source GeoJSON (one feature per region, identified by its FIPS code) is
+preprocessed once per version of the file: every ring is simplified
+(Douglas-Peucker, GEOMETRY_TOLERANCE degrees) and its coordinates quantised
+to GEOMETRY_DECIMALS decimals, and only each feature's id (the zero-padded
+FIPS code) and geometry are kept. The result is written with a gzipped copy
+to GEOMETRY_DIR/<name>-<content hash>.json; figures reference it by URL
+(/_geometry/<file>), which is served with a long-lived Cache-Control, so the
+browser downloads each geometry once instead of with every figure.
+
+Prebuild during deploy with:
+
+    python geometry.py build
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+import numpy as np
+
+from snapshot import file_sha1, is_fresh
+
+GEOMETRY_DIR = os.environ.get("GEOMETRY_DIR", ".geometry")
+GEOMETRY_TOLERANCE = float(os.environ.get("GEOMETRY_TOLERANCE", 0.005))
+GEOMETRY_DECIMALS = int(os.environ.get("GEOMETRY_DECIMALS", 3))
+
+# Properties a source feature may carry its FIPS code in, when it has no id
+id_properties = ["GEOID", "FIPS", "fips", "CBSAFP", "GEO_ID"]
+
+# Prepared file names: <source name>-<hash>.json
+file_name_pattern = re.compile(r"^[A-Za-z0-9_.-]+-[0-9a-f]{16}\.json$")
+
+
+# =========================
+# Simplification
+# =========================
+def simplify_line(points, tolerance):
+    """Douglas-Peucker: the points of an (n, 2) array kept within tolerance of the line, ends always kept."""
+    n = len(points)
+    if n <= 2:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            stack += [(start, middle), (middle, end)]
+    return points[keep]
+
+
+def prepare_ring(ring, tolerance, decimals):
+    """A closed ring simplified and quantised, repeated points dropped; None if it collapses."""
+    points = np.asarray(ring, dtype=float)[:, :2]
+    if len(points) < 4:
+        return None
+    # Split the closed ring at its farthest point so both halves have distinct ends
+    far = int(np.argmax(np.hypot(*(points - points[0]).T)))
+    halves = [simplify_line(points[:far + 1], tolerance), simplify_line(points[far:], tolerance)]
+    points = np.round(np.concatenate([halves[0], halves[1][1:]]), decimals)
+    points = points[np.concatenate([[True], np.any(points[1:] != points[:-1], axis=1)])]
+    if len(points) < 4:
+        return None
+    return points.tolist()
+
+
+def prepare_geometry(geometry, tolerance, decimals):
+    """A Polygon / MultiPolygon with its rings prepared; None if nothing is left of it."""
+    if geometry is None:
+        return None
+    polygons = geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+    prepared = []
+    for polygon in polygons:
+        rings = [prepare_ring(ring, tolerance, decimals) for ring in polygon]
+        if rings and rings[0] is not None:     # an outer ring too small to draw drops its holes too
+            prepared.append([ring for ring in rings if ring is not None])
+    if not prepared:
+        return None
+    if len(prepared) == 1:
+        return {"type": "Polygon", "coordinates": prepared[0]}
+    return {"type": "MultiPolygon", "coordinates": prepared}
+
+
+def feature_id(feature):
+    """The feature's FIPS code, zero-padded to 5 digits (None if it has none)."""
+    value = feature.get("id")
+    if value is None:
+        properties = feature.get("properties") or {}
+        value = next((properties[name] for name in id_properties if properties.get(name) is not None), None)
+    if value is None:
+        return None
+    return str(value).strip().split("US")[-1].zfill(5)
+
+
+def simplify_collection(collection, tolerance=GEOMETRY_TOLERANCE, decimals=GEOMETRY_DECIMALS):
+    """The FeatureCollection reduced to prepared geometries keyed by FIPS code in "id"."""
+    features = []
+    for feature in collection["features"]:
+        fips = feature_id(feature)
+        geometry = prepare_geometry(feature.get("geometry"), tolerance, decimals)
+        if fips is not None and geometry is not None:
+            features.append({"type": "Feature", "id": fips, "geometry": geometry})
+    return {"type": "FeatureCollection", "features": features}
+
+
+# =========================
+# Prepared files
+# =========================
+def manifest_path(source, out_dir=GEOMETRY_DIR):
+    return os.path.join(out_dir, os.path.basename(source) + ".manifest.json")
+
+
+def read_manifest(source, out_dir=GEOMETRY_DIR):
+    try:
+        with open(manifest_path(source, out_dir)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (manifest.get("tolerance"), manifest.get("decimals")) != (GEOMETRY_TOLERANCE, GEOMETRY_DECIMALS):
+        return None
+    if not os.path.exists(os.path.join(out_dir, manifest["file"] + ".gz")):
+        return None
+    return manifest
+
+
+def write_atomic(path, data, out_dir):
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=out_dir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def build(source, out_dir=GEOMETRY_DIR):
+    """Prepare the source GeoJSON; returns its manifest (file name, sizes, feature count)."""
+    st = os.stat(source)
+    with open(source) as f:
+        collection = simplify_collection(json.load(f))
+    data = json.dumps(collection, separators=(",", ":")).encode()
+    stem = os.path.splitext(os.path.basename(source))[0]
+    name = f"{stem}-{hashlib.sha1(data).hexdigest()[:16]}.json"
+
+    os.makedirs(out_dir, exist_ok=True)
+    write_atomic(os.path.join(out_dir, name), data, out_dir)
+    write_atomic(os.path.join(out_dir, name + ".gz"), gzip.compress(data, 9), out_dir)
+    manifest = {
+        "source": os.path.basename(source),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha1": file_sha1(source),
+        "tolerance": GEOMETRY_TOLERANCE,
+        "decimals": GEOMETRY_DECIMALS,
+        "file": name,
+        "features": len(collection["features"]),
+        "bytes": len(data),
+    }
+    write_atomic(manifest_path(source, out_dir), json.dumps(manifest, indent=2).encode(), out_dir)
+
+    # Earlier preparations of the same source can't be referenced by new figures
+    earlier = re.compile(rf"^{re.escape(stem)}-[0-9a-f]{{16}}\.json(\.gz)?$")
+    for entry in os.scandir(out_dir):
+        if earlier.match(entry.name) and not entry.name.startswith(name):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    return manifest
+
+
+def prepare(source, out_dir=GEOMETRY_DIR):
+    """The prepared file name for the source GeoJSON, building it if it is missing or stale."""
+    manifest = read_manifest(source, out_dir)
+    if not is_fresh(source, manifest):
+        manifest = build(source, out_dir)
+    return manifest["file"]
+
+
+def url(name):
+    return f"/_geometry/{name}"
+
+
+def read_geometry_bytes(name, out_dir=GEOMETRY_DIR):
+    """The gzipped prepared GeoJSON, or None (also for names that can't be ours)."""
+    if not file_name_pattern.match(name):
+        return None
+    try:
+        with open(os.path.join(out_dir, name + ".gz"), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+# =========================
+# CLI
+# =========================
+def main(argv=None):
+    from dataset import density_levels
+
+    sources = [spec["geometry"] for spec in density_levels.values() if "geometry" in spec]
+    parser = argparse.ArgumentParser(description="Simplify and quantise the region boundary GeoJSON files.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="(re)build prepared geometry for stale or missing sources")
+    build_parser.add_argument("paths", nargs="*", default=sources)
+    build_parser.add_argument("--dir", default=GEOMETRY_DIR, help="output directory (default: %(default)s)")
+    build_parser.add_argument("--force", action="store_true", help="rebuild even if the output is fresh")
+    args = parser.parse_args(argv)
+
+    for source in args.paths:
+        if not os.path.exists(source):
+            print(f"{source}: missing, skipped")
+            continue
+        if not args.force and is_fresh(source, read_manifest(source, args.dir)):
+            print(f"{source}: fresh")
+            continue
+        manifest = build(source, args.dir)
+        print(f"{source}: {manifest['features']} features, {manifest['size']} -> {manifest['bytes']} bytes "
+              f"-> {os.path.join(args.dir, manifest['file'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,469 @@
+"""
+Streaming ingestion: regenerate the five aggregate CSVs from raw job postings.
+
+    python ingest.py postings.csv [--dest DIR] [--store DIR] [--workers N] [--chunksize ROWS]
+    python ingest.py new_month.csv --store DIR --incremental [--dest DIR] [--snapshots]
+
+The raw file is a CSV with one posting per row: state, year, career area, a
+delimited skill list and an AI flag (column names and the skill separator are
+options). It is split at line breaks into byte ranges; each worker parses its
+ranges in chunks of --chunksize rows and reduces every chunk to additive counts
+per (state, year), (state, career area) and (state, career area, skill), so
+memory is bounded by the number of distinct keys rather than the file size.
+The parent sums the counts and derives:
+
+- DensityMapDataV3.csv: AI and all postings per state and year, the AI share
+  within the state and the state's percent of that year's national AI postings
+- CareerAreaIntensity.csv: all and AI postings per state and career area
+- TopAICareerDataV2_with_other.csv: career areas with AI postings, as a share
+  of the state's AI postings
+- TopAISkillsChartDataV2_with_other.csv and
+  TopAISkillsChartData_CareerArea.csv: skill mentions on AI postings per state
+  (and career area), the top --top-skills (ties kept) plus an "Other" row
+
+Skills are counted once per posting; postings without a career area count
+towards their state's skills but not the per-career-area table. Quoted fields
+must not contain line breaks. Each file is written to a temporary name and
+renamed into place, so a running app picks the new data up through its file
+poller (see dataset.py); --snapshots also rebuilds the app's column snapshots.
+
+With --store the counts (and the published tables) are kept in a directory.
+--incremental then reads only a new batch, adds its counts to the store and
+recomputes the derived columns (proportion, intensity, shares, top skills)
+just for the states it touches, and for its years in the density map, whose
+percent depends on the national total. Each batch's SHA-1 is recorded so the
+same file is never folded in twice.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from snapshot import SNAPSHOT_DIR, TABLES, build_snapshot
+
+# Output file -> whether its text fields are quoted (as the files the app shipped with)
+OUTPUTS = {
+    "DensityMapDataV3.csv": False,
+    "CareerAreaIntensity.csv": False,
+    "TopAICareerDataV2_with_other.csv": True,
+    "TopAISkillsChartDataV2_with_other.csv": True,
+    "TopAISkillsChartData_CareerArea.csv": True,
+}
+
+# Raw column roles and their default names
+DEFAULT_COLUMNS = {
+    "state": "state_name",
+    "year": "year",
+    "career_area": "lot_career_area_name",
+    "skills": "skills_name",
+    "ai": "is_ai",
+}
+
+truthy = {"1", "1.0", "true", "t", "yes", "y"}
+
+
+# =========================
+# Splitting
+# =========================
+class RangeFile(io.RawIOBase):
+    """Read-only view of bytes [start, end) of a file."""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._left = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self._left)
+        if n <= 0:
+            return 0
+        data = self._file.read(n)
+        buffer[:len(data)] = data
+        self._left -= len(data)
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        line = f.readline()
+        return next(csv.reader([line.decode("utf-8-sig")])), f.tell()
+
+
+def byte_ranges(path, start, parts):
+    """Split bytes [start, EOF) into about `parts` ranges that each begin at a line start."""
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path, "rb") as f:
+        for i in range(1, parts):
+            f.seek(max(start + (size - start) * i // parts, bounds[-1]))
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > bounds[-1]:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# =========================
+# Counting
+# =========================
+def count_chunk(df, columns, skills_sep):
+    """Additive counts for one chunk of postings."""
+    df = df[df[columns["state"]].notna()]
+    state = df[columns["state"]].astype(str)
+    area = df[columns["career_area"]].fillna("").astype(str)
+    year = pd.to_numeric(df[columns["year"]], errors="coerce")
+    ai = df[columns["ai"]].astype(str).str.strip().str.lower().isin(truthy).astype("int64")
+
+    frame = pd.DataFrame({"state_name": state, "year": year, "lot_career_area_name": area, "ai": ai})
+    state_year = (frame.dropna(subset=["year"]).astype({"year": "int64"})
+                  .groupby(["state_name", "year"])["ai"].agg(all="size", ai="sum"))
+    state_area = frame.groupby(["state_name", "lot_career_area_name"])["ai"].agg(all="size", ai="sum")
+
+    ai_rows = frame[ai == 1]
+    skills = df.loc[ai_rows.index, columns["skills"]].dropna().astype(str).str.split(skills_sep).explode()
+    mentions = pd.DataFrame({"row": skills.index, "skills_name": skills.str.strip().to_numpy()})
+    mentions = mentions[mentions["skills_name"] != ""].drop_duplicates()
+    mentions["state_name"] = ai_rows.loc[mentions["row"], "state_name"].to_numpy()
+    mentions["lot_career_area_name"] = ai_rows.loc[mentions["row"], "lot_career_area_name"].to_numpy()
+    area_skill = mentions.groupby(["state_name", "lot_career_area_name", "skills_name"]).size()
+
+    return {"state_year": state_year, "state_area": state_area, "area_skill": area_skill}
+
+
+def merge_counts(total, part):
+    if total is None:
+        return part
+    return {name: total[name].add(part[name], fill_value=0) for name in total}
+
+
+def count_range(task):
+    path, start, end, header, columns, skills_sep, chunksize = task
+    text = io.TextIOWrapper(io.BufferedReader(RangeFile(path, start, end)), encoding="utf-8", newline="")
+    total = None
+    with text:
+        reader = pd.read_csv(text, header=None, names=header, usecols=list(columns.values()),
+                             dtype=str, chunksize=chunksize)
+        for chunk in reader:
+            total = merge_counts(total, count_chunk(chunk, columns, skills_sep))
+    return total
+
+
+# =========================
+# Aggregates
+# =========================
+def density_table(state_year):
+    counts = state_year.reset_index()
+    national = counts.groupby("year")["ai"].transform("sum")
+    return pd.DataFrame({
+        "state_name": counts["state_name"],
+        "year": counts["year"].astype("int64"),
+        "ai_jobs_count": counts["ai"].astype("int64"),
+        "percent": (counts["ai"] / national.where(national > 0) * 100).fillna(0.0),
+        "all_jobs_state_year": counts["all"].astype("int64"),
+        "state_ai_share_within_state": counts["ai"] / counts["all"],
+    }).sort_values(["state_name", "year"], ignore_index=True)
+
+
+def intensity_table(state_area):
+    counts = state_area.reset_index()
+    table = pd.DataFrame({
+        "state_name": counts["state_name"],
+        "lot_career_area_name": counts["lot_career_area_name"],
+        "all_jobs": counts["all"].astype("int64"),
+        "ai_jobs": counts["ai"].astype("int64"),
+        "intensity": counts["ai"] / counts["all"],
+    })
+    return table.sort_values(["state_name", "intensity", "lot_career_area_name"],
+                             ascending=[True, False, True], ignore_index=True)
+
+
+def career_share_table(state_area):
+    counts = state_area.reset_index()
+    counts = counts[counts["ai"] > 0]
+    total = counts.groupby("state_name")["ai"].transform("sum")
+    table = pd.DataFrame({
+        "state_name": counts["state_name"],
+        "lot_career_area_name": counts["lot_career_area_name"],
+        "entry_count": counts["ai"].astype("int64"),
+        "total_jobs": total.astype("int64"),
+        "proportion": counts["ai"] / total,
+    })
+    return table.sort_values(["state_name", "entry_count", "lot_career_area_name"],
+                             ascending=[True, False, True], ignore_index=True)
+
+
+def top_skills_table(skill_counts, keys, top):
+    """Per group of `keys`: the `top` skills by count (ties at the cut kept) plus an "Other" row."""
+    counts = skill_counts.rename("skill_count").reset_index()
+    rank = counts.groupby(keys)["skill_count"].rank(method="min", ascending=False)
+    rest = counts[rank > top]
+    other = rest.groupby(keys, as_index=False)["skill_count"].sum().assign(skills_name="Other")
+    table = pd.concat([counts[rank <= top], other], ignore_index=True)
+    table = table.groupby(keys + ["skills_name"], as_index=False)["skill_count"].sum()
+
+    table["skill_count"] = table["skill_count"].astype("int64")
+    table["total_ai_listings"] = table.groupby(keys)["skill_count"].transform("sum")
+    table["proportion"] = table["skill_count"] / table["total_ai_listings"]
+    table["is_other"] = table["skills_name"] == "Other"
+    table = table.sort_values(keys + ["is_other", "skill_count", "skills_name"],
+                              ascending=[True] * len(keys) + [True, False, True], ignore_index=True)
+    return table[keys + ["skills_name", "skill_count", "total_ai_listings", "proportion"]]
+
+
+def build_tables(counts, top_skills=10):
+    area_skill = counts["area_skill"]
+    state_skill = area_skill.groupby(level=["state_name", "skills_name"]).sum()
+    return {
+        "DensityMapDataV3.csv": density_table(counts["state_year"]),
+        "CareerAreaIntensity.csv": intensity_table(counts["state_area"]),
+        "TopAICareerDataV2_with_other.csv": career_share_table(counts["state_area"]),
+        "TopAISkillsChartDataV2_with_other.csv": top_skills_table(state_skill, ["state_name"], top_skills),
+        "TopAISkillsChartData_CareerArea.csv": top_skills_table(
+            area_skill[area_skill.index.get_level_values("lot_career_area_name") != ""],
+            ["state_name", "lot_career_area_name"], top_skills),
+    }
+
+
+def write_table(df, path, quoted):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".csv", dir=directory)
+    with os.fdopen(fd, "w", newline="") as f:
+        df.to_csv(f, index=False, quoting=csv.QUOTE_NONNUMERIC if quoted else csv.QUOTE_MINIMAL)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+# Tables keyed by state, except the density map whose percent depends on the year's national total
+group_keys = {
+    "DensityMapDataV3.csv": "year",
+    "CareerAreaIntensity.csv": "state_name",
+    "TopAICareerDataV2_with_other.csv": "state_name",
+    "TopAISkillsChartDataV2_with_other.csv": "state_name",
+    "TopAISkillsChartData_CareerArea.csv": "state_name",
+}
+
+
+def select(counts, level, values):
+    return counts[counts.index.get_level_values(level).isin(values)]
+
+
+def update_tables(tables, counts, batch, top_skills=10):
+    """
+    Fold a batch into published tables: only the groups (states, or years for
+    the density map) the batch touched are recomputed from the updated counts;
+    every other row is kept as it was.
+    """
+    states = batch["state_area"].index.get_level_values("state_name").unique()
+    years = batch["state_year"].index.get_level_values("year").unique()
+    fresh = build_tables({
+        "state_year": select(counts["state_year"], "year", years),
+        "state_area": select(counts["state_area"], "state_name", states),
+        "area_skill": select(counts["area_skill"], "state_name", states),
+    }, top_skills)
+
+    updated = {}
+    for name, key in group_keys.items():
+        affected = years if key == "year" else states
+        old = tables[name]
+        merged = pd.concat([old[~old[key].isin(affected)], fresh[name]], ignore_index=True)
+        # Groups come out of build_tables sorted internally; a stable sort by state keeps that order
+        order = ["state_name", "year"] if key == "year" else ["state_name"]
+        updated[name] = merged.sort_values(order, kind="stable", ignore_index=True)
+    return updated
+
+
+# =========================
+# Count store
+# =========================
+# Index columns of each persisted count table
+count_index = {
+    "state_year": ["state_name", "year"],
+    "state_area": ["state_name", "lot_career_area_name"],
+    "area_skill": ["state_name", "lot_career_area_name", "skills_name"],
+}
+STORE_MANIFEST = "manifest.json"
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_store(store):
+    """(manifest, counts, tables) from a count store, or None if there is none."""
+    try:
+        with open(os.path.join(store, STORE_MANIFEST)) as f:
+            manifest = json.load(f)
+    except OSError:
+        return None
+    counts = {}
+    for name, index in count_index.items():
+        df = pd.read_csv(os.path.join(store, "counts", f"{name}.csv"), keep_default_na=False)
+        counts[name] = df.set_index(index).squeeze("columns") if name == "area_skill" else df.set_index(index)
+    # round_trip so rows that are carried over unchanged are republished digit for digit
+    tables = {name: pd.read_csv(os.path.join(store, "tables", name), keep_default_na=False,
+                                float_precision="round_trip") for name in OUTPUTS}
+    return manifest, counts, tables
+
+
+def write_store(store, manifest, counts, tables):
+    """Write the whole store to a temporary directory and swap it in."""
+    parent = os.path.dirname(os.path.abspath(store))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    os.makedirs(os.path.join(tmp, "counts"))
+    os.makedirs(os.path.join(tmp, "tables"))
+    for name, df in counts.items():
+        df.astype("int64").to_csv(os.path.join(tmp, "counts", f"{name}.csv"))
+    for name, quoted in OUTPUTS.items():
+        write_table(tables[name], os.path.join(tmp, "tables", name), quoted)
+    with open(os.path.join(tmp, STORE_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    old = os.path.abspath(store) + f".old-{os.getpid()}"
+    if os.path.exists(store):
+        os.replace(store, old)
+    os.replace(tmp, store)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+# =========================
+# CLI
+# =========================
+def count_file(path, workers=None, chunksize=200_000, skills_sep=";", columns=None):
+    """Additive counts for every posting in the raw file at path."""
+    columns = dict(DEFAULT_COLUMNS, **(columns or {}))
+    header, data_start = read_header(path)
+    missing = [name for name in columns.values() if name not in header]
+    if missing:
+        raise ValueError(f"{path}: missing columns {missing}")
+
+    workers = workers or os.cpu_count()
+    tasks = [(path, start, end, header, columns, skills_sep, chunksize)
+             for start, end in byte_ranges(path, data_start, workers * 4)]
+    counts = None
+    with multiprocessing.Pool(workers) as pool:
+        for part in pool.imap_unordered(count_range, tasks):
+            if part is not None:
+                counts = merge_counts(counts, part)
+    if counts is None:
+        raise ValueError(f"{path}: no postings")
+    return counts
+
+
+def publish(tables, dest, snapshot_dir=None):
+    """Write the five CSVs into dest and rebuild the app's snapshots of them (see snapshot.py)."""
+    os.makedirs(dest, exist_ok=True)
+    for name, quoted in OUTPUTS.items():
+        write_table(tables[name], os.path.join(dest, name), quoted)
+    if snapshot_dir is not None:
+        for name in TABLES:
+            build_snapshot(os.path.join(dest, name), snapshot_dir)
+
+
+def batch_record(path):
+    return {"source": os.path.basename(path), "sha1": file_sha1(path),
+            "ingested": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def ingest(path, dest=".", workers=None, chunksize=200_000, skills_sep=";", columns=None, top_skills=10,
+           store=None, snapshot_dir=None):
+    """
+    Count the raw postings at path and write the five aggregate CSVs into dest.
+    With a store directory the counts are kept there (replacing any previous
+    store) for later incremental updates. Returns the tables.
+    """
+    counts = count_file(path, workers, chunksize, skills_sep, columns)
+    tables = build_tables(counts, top_skills)
+    if store is not None:
+        write_store(store, {"top_skills": top_skills, "batches": [batch_record(path)]}, counts, tables)
+    publish(tables, dest, snapshot_dir)
+    return tables
+
+
+def ingest_incremental(path, store, dest=".", workers=None, chunksize=200_000, skills_sep=";", columns=None,
+                       snapshot_dir=None):
+    """
+    Fold a new batch of postings into the count store and republish. Only the
+    batch is read; derived columns are recomputed for the states (and density
+    years) it touches. Returns the tables, or None if the batch was already
+    ingested.
+    """
+    stored = read_store(store)
+    if stored is None:
+        raise ValueError(f"{store}: no count store; run a full ingest with --store first")
+    manifest, counts, tables = stored
+    record = batch_record(path)
+    if any(batch["sha1"] == record["sha1"] for batch in manifest["batches"]):
+        return None
+
+    batch = count_file(path, workers, chunksize, skills_sep, columns)
+    counts = merge_counts(counts, batch)
+    tables = update_tables(tables, counts, batch, manifest["top_skills"])
+    manifest["batches"].append(record)
+    write_store(store, manifest, counts, tables)
+    publish(tables, dest, snapshot_dir)
+    return tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate the dashboard CSVs from raw job postings.")
+    parser.add_argument("postings", help="raw postings CSV, one posting per row")
+    parser.add_argument("--dest", default=".", help="directory for the five CSVs (default: %(default)s)")
+    parser.add_argument("--store", help="directory keeping the additive counts for incremental updates")
+    parser.add_argument("--incremental", action="store_true",
+                        help="fold the postings into --store instead of recounting everything")
+    parser.add_argument("--snapshots", action="store_true",
+                        help=f"also rebuild the app's snapshots in DEST/{SNAPSHOT_DIR}")
+    parser.add_argument("--workers", type=int, help="processes to use (default: all cores)")
+    parser.add_argument("--chunksize", type=int, default=200_000, help="rows parsed at a time per worker")
+    parser.add_argument("--skills-sep", default=";", help="separator in the skills column (default: %(default)s)")
+    parser.add_argument("--top-skills", type=int, default=10, help="skills kept per group before \"Other\"")
+    for role, default in DEFAULT_COLUMNS.items():
+        parser.add_argument(f"--{role.replace('_', '-')}-column", dest=f"{role}_column", default=default,
+                            help=f"raw column holding the {role.replace('_', ' ')} (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.incremental and not args.store:
+        parser.error("--incremental needs --store")
+
+    start = time.perf_counter()
+    columns = {role: getattr(args, f"{role}_column") for role in DEFAULT_COLUMNS}
+    snapshot_dir = os.path.join(args.dest, SNAPSHOT_DIR) if args.snapshots else None
+    if args.incremental:
+        tables = ingest_incremental(args.postings, args.store, args.dest, args.workers, args.chunksize,
+                                    args.skills_sep, columns, snapshot_dir)
+        if tables is None:
+            print(f"{args.postings}: already ingested into {args.store}, nothing to do")
+            return 0
+    else:
+        tables = ingest(args.postings, args.dest, args.workers, args.chunksize, args.skills_sep, columns,
+                        args.top_skills, args.store, snapshot_dir)
+    for name, df in tables.items():
+        print(f"{name}: {len(df)} rows")
+    print(f"done in {time.perf_counter() - start:.1f}s -> {args.dest}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
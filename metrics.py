@@ -0,0 +1,193 @@
+"""
+Per-callback performance instrumentation, exported in Prometheus text format.
+
+instrument_callbacks(app) wraps every registered Dash callback and records,
+per call: wall time, CPU time, time per phase, serialised response size and
+figure-cache status. Callbacks mark their own phases with
+
+    with phase("aggregate"):
+        ...
+    with phase("figure"):
+        ...
+
+and Dash's JSON serialisation is timed as the "serialise" phase. That hooks
+a Dash internal (dash._callback.to_json); when a Dash version lacks it or no
+longer serialises through it, a warning is logged once and the phase is
+simply not recorded. Calls slower than SLOW_CALLBACK_SECONDS are logged.
+Metrics are per process; with several gunicorn workers each scrape sees the
+worker that answered it.
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+try:
+    from dash import _callback
+except ImportError:     # private module; see instrument_callbacks
+    _callback = None
+
+logger = logging.getLogger(__name__)
+
+SLOW_CALLBACK_SECONDS = float(os.environ.get("SLOW_CALLBACK_SECONDS", 1.0))
+
+# The record of the callback call running in this context (None outside callbacks)
+_current = contextvars.ContextVar("callback_record", default=None)
+# Whether the serialise phase was found missing (and said so) already
+_serialise_missing = False
+
+
+# =========================
+# Histograms
+# =========================
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values, rendered in Prometheus text format."""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = sorted(buckets)
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+            for j in range(i, len(self.buckets)):
+                series[j] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+        for label_values, series in items:
+            labels = ",".join(f'{k}="{escape(v)}"' for k, v in zip(self.labels, label_values))
+            sep = "," if labels else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]:.6g}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return "\n".join(lines)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+latency_buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+size_buckets = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+
+callback_seconds = Histogram("dash_callback_duration_seconds", "Wall time per callback call.",
+                             ["callback", "cache"], latency_buckets)
+callback_cpu_seconds = Histogram("dash_callback_cpu_seconds", "Thread CPU time per callback call.",
+                                 ["callback"], latency_buckets)
+phase_seconds = Histogram("dash_callback_phase_seconds",
+                          "Wall time per callback phase (aggregate, figure, serialise).",
+                          ["callback", "phase"], latency_buckets)
+response_bytes = Histogram("dash_callback_response_bytes", "Serialised callback response size.",
+                           ["callback"], size_buckets)
+histograms = [callback_seconds, callback_cpu_seconds, phase_seconds, response_bytes]
+
+
+# =========================
+# Recording
+# =========================
+@contextlib.contextmanager
+def phase(name):
+    """Time a block as one phase of the current callback call (no-op outside instrumented callbacks)."""
+    record = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record["phases"][name] = record["phases"].get(name, 0.0) + time.perf_counter() - start
+
+
+def set_cache_status(status):
+    """
+    Mark the current callback call as a figure-cache "hit", pre-rendered "store" hit,
+    "coalesced" (joined an identical build in flight) or "miss".
+    """
+    record = _current.get()
+    if record is not None:
+        record["cache"] = status
+
+
+def _timed_to_json(to_json):
+    @functools.wraps(to_json)
+    def wrapper(*args, **kwargs):
+        with phase("serialise"):
+            return to_json(*args, **kwargs)
+    wrapper._instrumented = True
+    return wrapper
+
+
+def instrument_callback(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        record = {"phases": {}, "cache": "none"}
+        token = _current.set(record)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        body = None
+        try:
+            body = func(*args, **kwargs)
+            return body
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            _current.reset(token)
+
+            callback_seconds.observe(wall, name, record["cache"])
+            callback_cpu_seconds.observe(cpu, name)
+            for phase_name, seconds in record["phases"].items():
+                phase_seconds.observe(seconds, name, phase_name)
+            if isinstance(body, str):
+                response_bytes.observe(len(body), name)
+                if "serialise" not in record["phases"]:
+                    _warn_serialise_missing("Dash no longer serialises callback responses through "
+                                            "dash._callback.to_json")
+            if wall >= SLOW_CALLBACK_SECONDS:
+                phases = ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in record["phases"].items())
+                logger.warning("Slow callback %s: %.1fms wall, %.1fms cpu, cache=%s (%s)",
+                               name, wall * 1000, cpu * 1000, record["cache"], phases)
+    return wrapper
+
+
+def _warn_serialise_missing(reason):
+    global _serialise_missing
+    if not _serialise_missing:
+        _serialise_missing = True
+        logger.warning("%s; the serialise phase of callbacks is not recorded", reason)
+
+
+def instrument_callbacks(app):
+    """Wrap every callback registered on app so far (call after the last @app.callback)."""
+    to_json = getattr(_callback, "to_json", None)
+    if not callable(to_json):
+        _warn_serialise_missing("dash._callback.to_json not found")
+    elif not getattr(to_json, "_instrumented", False):
+        # Dash serialises the response inside its own callback wrapper via this module global
+        _callback.to_json = _timed_to_json(to_json)
+    for entry in app.callback_map.values():
+        func = entry.get("callback")    # clientside callbacks have none
+        if func is not None and not getattr(func, "_instrumented", False):
+            entry["callback"] = instrument_callback(func.__name__, func)
+            entry["callback"]._instrumented = True
+
+
+def render(extra=()):
+    """All histograms plus any extra (name, type, help, value) samples, as Prometheus text."""
+    parts = [h.render() for h in histograms]
+    for name, kind, help_text, value in extra:
+        parts.append(f"# HELP {name} {help_text}\n# TYPE {name} {kind}\n{name} {value}")
+    return "\n".join(parts) + "\n"
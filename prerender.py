@@ -0,0 +1,146 @@
+"""
+Offline pre-rendered figure store.
+
+Every career chart (state 1 x state 2 x metric) and every single-year (plus
+full-range, plus trend) density map at each level is a finite set, so it can be rendered ahead of time:
+
+    python prerender.py build [--workers N] [--dir DIR]
+
+writes each figure as gzipped JSON to DIR/<data version>/<figure>/<key>.json.gz,
+using a process pool over all cores. At runtime the figure cache looks figures
+up here before computing them, and /_prerendered/<figure>/<key>.json serves the
+files as they are, with ETags. Only the current data version's directory is
+ever read, so a stale store simply falls back to live rendering.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+PRERENDER_DIR = os.environ.get("PRERENDER_DIR", ".prerender")
+
+# The cached figure builders in Oct9P2.py that are pre-rendered
+FIGURES = ["career_figure", "density_figure"]
+
+
+def figure_key(args_key):
+    """File name stem for a builder's normalised arguments (see cached_figure in Oct9P2.py)."""
+    return hashlib.sha1(json.dumps(args_key).encode()).hexdigest()[:20]
+
+
+def figure_path(name, version, key, store_dir=PRERENDER_DIR):
+    return os.path.join(store_dir, version, name, f"{key}.json.gz")
+
+
+def read_figure_bytes(name, version, key, store_dir=PRERENDER_DIR):
+    """The stored gzipped JSON for a figure, or None (also for names and keys that can't be ours)."""
+    if name not in FIGURES or not key.isalnum():
+        return None
+    try:
+        with open(figure_path(name, version, key, store_dir), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def load_figure(name, version, args_key, store_dir=PRERENDER_DIR):
+    """The JSON text of a pre-rendered figure, or None when it isn't in the store."""
+    data = read_figure_bytes(name, version, figure_key(args_key), store_dir)
+    if data is None:
+        return None
+    return gzip.decompress(data).decode()
+
+
+def write_figure(path, fig):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(gzip.compress(fig.to_json().encode(), compresslevel=9))
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+# =========================
+# Build
+# =========================
+def jobs(dataset):
+    """(builder name, args) for every figure in the store."""
+    states = dataset.options["career_states"]
+    for metric in ["share", "intensity"]:
+        for state1 in states:
+            for state2 in states:
+                yield "career_figure", (state1, state2, metric)
+
+    for level in dataset.options["density_levels"]:
+        years = [int(y) for y in dataset.queries.density_years(level)]
+        for metric in ["state_share", "us_share"]:
+            yield "density_figure", (metric, [years[0], years[-1]], level)
+            for year in years:
+                yield "density_figure", (metric, [year, year], level)
+        yield "density_figure", ("trend", [years[0], years[-1]], level)
+
+
+_app = None
+
+
+def _init_worker(version):
+    global _app
+    import Oct9P2
+    if Oct9P2.datasets.current.version != version:
+        raise RuntimeError("data files changed while pre-rendering; run the build again")
+    _app = Oct9P2
+
+
+def _render(job):
+    name, args, store_dir, force = job
+    builder = getattr(_app, name)
+    dataset = _app.datasets.current
+    path = figure_path(name, dataset.version, figure_key(builder.normalise(*args)), store_dir)
+    if not force and os.path.exists(path):
+        return False
+    write_figure(path, builder.__wrapped__(*args, dataset=dataset))
+    return True
+
+
+def build(store_dir=PRERENDER_DIR, workers=None, force=False):
+    """Render every figure for the current data files. Returns (data version, rendered, skipped)."""
+    from dataset import load_dataset
+
+    dataset = load_dataset()
+    work = [(name, args, store_dir, force) for name, args in jobs(dataset)]
+    rendered = 0
+    with multiprocessing.Pool(workers or os.cpu_count(), _init_worker, (dataset.version,)) as pool:
+        for done in pool.imap_unordered(_render, work, chunksize=32):
+            rendered += done
+
+    # Figures for any other data version can never be served again
+    for entry in os.listdir(store_dir):
+        if entry != dataset.version and os.path.isdir(os.path.join(store_dir, entry)):
+            shutil.rmtree(os.path.join(store_dir, entry), ignore_errors=True)
+    return dataset.version, rendered, len(work) - rendered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-render the career and density figures.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="render every figure for the current data files")
+    build_cmd.add_argument("--dir", default=PRERENDER_DIR, help="store directory (default: %(default)s)")
+    build_cmd.add_argument("--workers", type=int, help="processes to use (default: all cores)")
+    build_cmd.add_argument("--force", action="store_true", help="re-render figures already in the store")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    version, rendered, skipped = build(args.dir, args.workers, args.force)
+    print(f"data version {version}: rendered {rendered}, already present {skipped} "
+          f"in {time.perf_counter() - start:.1f}s -> {os.path.join(args.dir, version)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,430 @@
+"""
+Query backends behind the chart callbacks.
+
+Each Dataset answers the charts' questions through `dataset.queries`:
+
+- MemoryQueries (QUERY_BACKEND=memory, the default): the pandas tables and
+  NumPy indexes held in the process (see dataset.py)
+- SQLiteQueries (QUERY_BACKEND=sqlite): an on-disk SQLite copy of the CSVs
+  with indexes on state, career area, skill and year. Filtering, grouping and
+  top-10 selection run in SQL, and only the answers are held in memory, so the
+  data can be larger than RAM.
+
+The SQLite file is built next to the column snapshots once per data version,
+streamed from the CSVs in chunks.
+"""
+import glob
+import os
+import sqlite3
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+from dataset import (bad_names, density_levels, fips_codes, name_key, national, query_density_index,
+                     query_skills_cube, query_skills_cube_states, state_abbrev, top_n)
+from snapshot import SNAPSHOT_DIR
+
+# Career chart value column per metric
+career_columns = {"share": "proportion", "intensity": "intensity"}
+
+
+class MemoryQueries:
+    """The in-process path: pandas tables and the indexes built on them in Dataset."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.skill_index = {s: i for i, s in enumerate(dataset.skills_cube["skills"])}
+
+    def options(self):
+        """The tab controls' option lists (sorted years, density levels, state names, career areas)."""
+        dataset = self.dataset
+        return {
+            "years": sorted(dataset.density_map_data["year"].dropna().unique()),
+            "density_levels": ["state", *dataset.region_index],
+            "career_states": sorted(dataset.top_ai_career_data["state_name"].dropna().unique()),
+            "skills_states": sorted(dataset.top_ai_skills_data["state_name"].dropna().unique()),
+            "skills_career_areas": sorted(dataset.top_ai_skills_data["lot_career_area_name"].dropna().unique()),
+        }
+
+    def row_counts(self):
+        dataset = self.dataset
+        return {
+            "density": len(dataset.density_map_data),
+            "skills": len(dataset.top_ai_skills_data),
+            "career_share": len(dataset.top_ai_career_data),
+            "career_intensity": len(dataset.career_intensity_data),
+        }
+
+    # Density map
+    def density_index(self, level):
+        return self.dataset.density_index if level == "state" else self.dataset.region_index[level]
+
+    def density_years(self, level="state"):
+        return self.density_index(level)["years"]
+
+    def density_totals(self, start_year, end_year, level="state"):
+        """
+        (names, codes, ai_jobs_count, total jobs) per area over the years. States
+        without rows in the range are left out; region levels list every region
+        in a fixed order, NaN where it has no rows, so a map's locations never change.
+        """
+        index = self.density_index(level)
+        ai_jobs, all_jobs, has_rows = query_density_index(index, start_year, end_year)
+        if level != "state":
+            return (index["names"], index["codes"],
+                    np.where(has_rows, ai_jobs, np.nan), np.where(has_rows, all_jobs, np.nan))
+        return index["names"][has_rows], index["codes"][has_rows], ai_jobs[has_rows], all_jobs[has_rows]
+
+    # Career chart
+    def career_top(self, state, metric, n=10):
+        """The state's n (None: all) career areas with the largest metric value (%): [lot_career_area_name, value]."""
+        ycol = career_columns[metric]
+        entry = self.dataset.career_index[metric].get(state)
+        if entry is None:
+            return pd.DataFrame({"lot_career_area_name": np.array([], dtype=object), ycol: np.array([])})
+        areas, values, order = entry
+        top = order[:n]
+        return pd.DataFrame({"lot_career_area_name": areas[top], ycol: values[top]})
+
+    def career_matrix(self, states, metric, areas):
+        """Values (%) of each state (rows) in each career area (columns), 0 where a state has none."""
+        matrix = self.dataset.career_matrix[metric]
+        rows = [matrix["state_index"].get(state, -1) for state in states]
+        columns = [matrix["area_index"].get(name_key(area), -1) for area in areas]
+        return np.nan_to_num(matrix["values"][np.ix_(rows, columns)])
+
+    # Skills chart
+    def area_mask(self, career_areas):
+        cube = self.dataset.skills_cube
+        if isinstance(career_areas, list) and "ALL" in career_areas:
+            return np.ones(len(cube["area_index"]), dtype=bool)
+        area_mask = np.zeros(len(cube["area_index"]), dtype=bool)
+        area_mask[[cube["area_index"][name_key(a)] for a in (career_areas or [])
+                   if name_key(a) in cube["area_index"]]] = True
+        return area_mask
+
+    def skills_top(self, state, career_areas, n=10):
+        """
+        The state's n (None: all) most mentioned skills over the career areas, largest first:
+        (skills, skill counts, denominator, proportions %), or None without data.
+        """
+        cube = self.dataset.skills_cube
+        if state not in cube["state_index"]:
+            return None
+        counts, denominator, proportion, present = query_skills_cube(cube, state, self.area_mask(career_areas))
+        if not present.any():
+            return None
+        top_idx = top_n(proportion, present, n)
+        return list(cube["skills"][top_idx]), counts[top_idx], denominator, proportion[top_idx]
+
+    def skills_matrix(self, states, career_areas, skills):
+        """(skill counts, denominators, proportions %, present) of each state (rows) for the skills (columns)."""
+        columns = [self.skill_index[s] for s in skills]
+        return query_skills_cube_states(self.dataset.skills_cube, states, self.area_mask(career_areas), columns)
+
+
+# =========================
+# SQLite
+# =========================
+# CSV -> (SQL table, numeric columns, indexes)
+sql_tables = {
+    "DensityMapDataV3.csv": ("density", ["year", "ai_jobs_count", "all_jobs_state_year"],
+                             [["year", "state_name"], ["state_name", "year"]]),
+    "TopAISkillsChartData_CareerArea.csv": ("skills", ["skill_count", "total_ai_listings"],
+                                            [["state_name", "lot_career_area_name", "skills_name"],
+                                             ["skills_name"]]),
+    "TopAICareerDataV2_with_other.csv": ("career_share", ["proportion"],
+                                         [["state_name", "lot_career_area_name"]]),
+    "CareerAreaIntensity.csv": ("career_intensity", ["intensity"], [["state_name", "lot_career_area_name"]]),
+    # Optional region tables (see dataset.density_levels)
+    "DensityMapCountyData.csv": ("density_county", ["year", "ai_jobs_count", "all_jobs_region_year"],
+                                 [["fips", "year"]]),
+    "DensityMapMetroData.csv": ("density_metro", ["year", "ai_jobs_count", "all_jobs_region_year"],
+                                [["fips", "year"]]),
+}
+
+
+def database_path(version, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, f"data-{version}.sqlite")
+
+
+def build_database(version, paths, required_columns, snapshot_dir=SNAPSHOT_DIR, chunksize=100_000):
+    """
+    Stream the CSVs into a new SQLite file for this data version and index it.
+    Returns the database path; files for versions before the previous one are removed.
+    """
+    target = database_path(version, snapshot_dir)
+    if os.path.exists(target):
+        return target
+    os.makedirs(snapshot_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".sqlite", dir=snapshot_dir)
+    os.close(fd)
+    con = sqlite3.connect(tmp)
+    try:
+        for csv_path in paths:
+            table, numeric, indexes = sql_tables[csv_path]
+            rows = 0
+            for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+                missing = [c for c in required_columns[csv_path] if c not in chunk.columns]
+                if missing:
+                    raise ValueError(f"{csv_path}: missing columns {missing}")
+                for column in numeric:
+                    if column in chunk.columns:
+                        chunk[column] = pd.to_numeric(chunk[column], errors="coerce")
+                if table == "density" and "state_abbrev" not in chunk.columns:
+                    chunk["state_abbrev"] = chunk["state_name"].map(state_abbrev)
+                if "fips" in chunk.columns:
+                    chunk["fips"] = fips_codes(chunk["fips"]).astype(object)
+                chunk.to_sql(table, con, if_exists="append", index=False)
+                rows += len(chunk)
+            if rows == 0:
+                raise ValueError(f"{csv_path}: no rows")
+            for columns in indexes:
+                con.execute(f"CREATE INDEX {table}_{'_'.join(columns)} ON {table} ({', '.join(columns)})")
+        con.execute("ANALYZE")
+        con.commit()
+        con.close()
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, target)
+    finally:
+        con.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    # Workers still on the previous version open its file lazily (a connection per request
+    # thread) until their poll swaps them over, so it is kept until the next build
+    def built(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return 0
+    earlier = sorted((path for path in glob.glob(database_path("*", snapshot_dir)) if path != target),
+                     key=built, reverse=True)
+    for old in earlier[1:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return target
+
+
+def not_bad(column):
+    """SQL condition excluding bad_names (NULL names are kept, as in pandas)."""
+    marks = ", ".join("?" * len(bad_names))
+    return f"({column} IS NULL OR lower(trim({column})) NOT IN ({marks}))"
+
+
+bad_params = sorted(bad_names)
+
+
+def in_filter(column, names):
+    """SQL condition and parameters for `column IN names`; a missing name (None / NaN) among them matches NULL."""
+    present = [name for name in names if name_key(name) is not None]
+    condition = f"{column} IN ({', '.join('?' * len(present))})"
+    if len(present) < len(names):
+        condition = f"({condition} OR {column} IS NULL)"
+    return condition, tuple(present)
+
+
+class SQLiteQueries:
+    """The same questions as MemoryQueries, answered by SQL against a read-only SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        # sqlite3 connections are per thread; each request thread opens its own read-only one
+        con = getattr(self._local, "connection", None)
+        if con is None:
+            con = self._local.connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True,
+                                                           check_same_thread=False)
+        return con
+
+    def rows(self, sql, params=()):
+        return self.connection.execute(sql, params).fetchall()
+
+    def options(self):
+        def column(sql):
+            return [row[0] for row in self.rows(sql)]
+        return {
+            "years": column("SELECT DISTINCT year FROM density WHERE year IS NOT NULL ORDER BY year"),
+            "density_levels": ["state", *[level for level in density_levels if level != "state"
+                                          and self.density_table(level) in self.tables()]],
+            "career_states": column("SELECT DISTINCT state_name FROM career_share "
+                                    "WHERE state_name IS NOT NULL ORDER BY state_name"),
+            "skills_states": column("SELECT DISTINCT state_name FROM skills "
+                                    "WHERE state_name IS NOT NULL ORDER BY state_name"),
+            "skills_career_areas": column("SELECT DISTINCT lot_career_area_name FROM skills "
+                                          "WHERE lot_career_area_name IS NOT NULL ORDER BY lot_career_area_name"),
+        }
+
+    def tables(self):
+        return {row[0] for row in self.rows("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    def row_counts(self):
+        present = self.tables()
+        return {table: self.rows(f"SELECT COUNT(*) FROM {table}")[0][0]
+                for table, _, _ in sql_tables.values() if table in present}
+
+    # Density map
+    @staticmethod
+    def density_table(level):
+        return sql_tables[density_levels[level]["table"]][0]
+
+    def density_years(self, level="state"):
+        spec = density_levels[level]
+        return np.asarray([row[0] for row in self.rows(
+            f"SELECT DISTINCT year FROM {self.density_table(level)} WHERE year IS NOT NULL "
+            f"AND {spec['name']} IS NOT NULL AND {spec['code']} IS NOT NULL ORDER BY year")])
+
+    def density_totals(self, start_year, end_year, level="state"):
+        spec = density_levels[level]
+        key, name, code = spec["key"], spec["name"], spec["code"]
+        other = code if key == name else name
+        if level == "state":
+            rows = self.rows(
+                f"SELECT {key}, MIN({other}), SUM(ai_jobs_count), SUM({spec['total']}) FROM density "
+                f"WHERE year BETWEEN ? AND ? AND {name} IS NOT NULL AND {code} IS NOT NULL "
+                f"GROUP BY {key} ORDER BY {key}", (start_year, end_year))
+        else:
+            # Every region, with NULL sums where it has no rows in the range (as in MemoryQueries)
+            in_range = "year BETWEEN ? AND ?"
+            rows = self.rows(
+                f"SELECT {key}, MIN({other}), SUM(CASE WHEN {in_range} THEN COALESCE(ai_jobs_count, 0) END), "
+                f"SUM(CASE WHEN {in_range} THEN COALESCE({spec['total']}, 0) END) FROM {self.density_table(level)} "
+                f"WHERE year IS NOT NULL AND {name} IS NOT NULL AND {code} IS NOT NULL "
+                f"GROUP BY {key} ORDER BY {key}", (start_year, end_year, start_year, end_year))
+        keys = np.asarray([r[0] for r in rows], dtype=object)
+        others = np.asarray([r[1] for r in rows], dtype=object)
+        missing = 0 if level == "state" else np.nan
+        ai_jobs = np.asarray([missing if r[2] is None else r[2] for r in rows], dtype=float)
+        all_jobs = np.asarray([missing if r[3] is None else r[3] for r in rows], dtype=float)
+        names, codes = (keys, others) if key == name else (others, keys)
+        return names, codes, ai_jobs, all_jobs
+
+    # Career chart
+    @staticmethod
+    def career_sql(metric):
+        if metric == "share":
+            return "career_share", "proportion * 100"
+        return "career_intensity", "COALESCE(intensity, 0) * 100"
+
+    def career_top(self, state, metric, n=10):
+        table, value = self.career_sql(metric)
+        ycol = career_columns[metric]
+        limit = -1 if n is None else n
+        if state == national:
+            # Mean over states of each state's first value per area (none counting as 0), ties in file order
+            rows = self.rows(
+                f"SELECT lot_career_area_name, SUM(COALESCE(v, 0)) / (SELECT COUNT(DISTINCT state_name) "
+                f"FROM {table} WHERE state_name IS NOT NULL AND {not_bad('lot_career_area_name')}) AS mean "
+                f"FROM (SELECT state_name, lot_career_area_name, {value} AS v, MIN(rowid) AS first FROM {table} "
+                f"WHERE state_name IS NOT NULL AND {not_bad('lot_career_area_name')} "
+                f"GROUP BY state_name, lot_career_area_name) "
+                f"GROUP BY lot_career_area_name ORDER BY mean DESC, MIN(first) LIMIT ?",
+                (*bad_params, *bad_params, limit))
+        else:
+            rows = self.rows(
+                f"SELECT lot_career_area_name, {value} AS v FROM {table} "
+                f"WHERE state_name = ? AND {not_bad('lot_career_area_name')} "
+                f"ORDER BY v IS NULL, v DESC, rowid LIMIT ?", (state, *bad_params, limit))
+        return pd.DataFrame(rows, columns=["lot_career_area_name", ycol]).astype({ycol: float})
+
+    def career_matrix(self, states, metric, areas):
+        table, value = self.career_sql(metric)
+        listed = [s for s in states if s != national]
+        area_condition, area_params = in_filter("lot_career_area_name", list(areas))
+        rows = self.rows(
+            f"SELECT state_name, lot_career_area_name, {value} FROM {table} "
+            f"WHERE state_name IN ({', '.join('?' * len(listed))}) "
+            f"AND {area_condition} AND {not_bad('lot_career_area_name')} "
+            f"ORDER BY rowid", (*listed, *area_params, *bad_params))
+        if national in states:
+            top = self.career_top(national, metric, n=None)
+            rows += [(national, area, v) for area, v in zip(top.iloc[:, 0], top.iloc[:, 1])]
+        # A state's first row per area (missing names as None), aligned to the requested order
+        first = {}
+        for state, area, v in rows:
+            first.setdefault((state, name_key(area)), v)
+        values = [[first.get((state, name_key(area))) for area in areas] for state in states]
+        return np.nan_to_num(np.asarray(values, dtype=float).reshape(len(states), len(areas)))
+
+    # Skills chart
+    @staticmethod
+    def area_filter(career_areas):
+        """SQL condition and parameters for the career-area selection ("ALL" selects every area)."""
+        if isinstance(career_areas, list) and "ALL" in career_areas:
+            return "1", ()
+        return in_filter("lot_career_area_name", list(career_areas or []))
+
+    @staticmethod
+    def state_filter(state):
+        """SQL condition and parameters for one state's rows (every state's for `national`)."""
+        if state == national:
+            return "state_name IS NOT NULL", ()
+        return "state_name = ?", (state,)
+
+    def skills_denominator(self, state, career_areas):
+        # One total_ai_listings per (state, career area), repeated on every skill row: deduplicate first
+        areas, params = self.area_filter(career_areas)
+        states, state_params = self.state_filter(state)
+        return self.rows(
+            f"SELECT COALESCE(SUM(t), 0) FROM (SELECT DISTINCT state_name, lot_career_area_name, "
+            f"COALESCE(total_ai_listings, 0) AS t FROM skills "
+            f"WHERE {states} AND {areas} AND {not_bad('skills_name')})",
+            (*state_params, *params, *bad_params))[0][0]
+
+    def skills_top(self, state, career_areas, n=10):
+        areas, params = self.area_filter(career_areas)
+        states, state_params = self.state_filter(state)
+        rows = self.rows(
+            f"SELECT skills_name, SUM(COALESCE(skill_count, 0)) AS c FROM skills "
+            f"WHERE {states} AND {areas} AND skills_name IS NOT NULL AND {not_bad('skills_name')} "
+            f"GROUP BY skills_name ORDER BY c DESC, skills_name LIMIT ?",
+            (*state_params, *params, *bad_params, -1 if n is None else n))
+        if not rows:
+            return None
+        denominator = self.skills_denominator(state, career_areas)
+        counts = np.asarray([r[1] for r in rows], dtype=float)
+        proportion = counts / denominator * 100 if denominator > 0 else np.zeros_like(counts)
+        return [r[0] for r in rows], counts, denominator, proportion
+
+    def skills_matrix(self, states, career_areas, skills):
+        areas, params = self.area_filter(career_areas)
+        listed = [s for s in states if s != national]
+        # (condition, its parameters, grouping) for the listed states together and for the national total
+        scopes = []
+        if listed:
+            scopes.append((f"state_name IN ({', '.join('?' * len(listed))})", tuple(listed), True))
+        if national in states:
+            scopes.append(("state_name IS NOT NULL", (), False))
+
+        counts, totals = {}, {}
+        for condition, state_params, by_state in scopes:
+            key, key_params = ("state_name", ()) if by_state else ("?", (national,))
+            group = "GROUP BY state_name" if by_state else ""
+            for state, skill, count in self.rows(
+                    f"SELECT {key}, skills_name, SUM(COALESCE(skill_count, 0)) FROM skills "
+                    f"WHERE {condition} AND {areas} AND skills_name IN ({', '.join('?' * len(skills))}) "
+                    f"GROUP BY {'state_name, ' if by_state else ''}skills_name",
+                    (*key_params, *state_params, *params, *skills)):
+                counts[state, skill] = count
+            totals.update(self.rows(
+                f"SELECT {key}, COALESCE(SUM(t), 0) FROM (SELECT DISTINCT state_name, lot_career_area_name, "
+                f"COALESCE(total_ai_listings, 0) AS t FROM skills "
+                f"WHERE {condition} AND {areas} AND {not_bad('skills_name')}) {group}",
+                (*key_params, *state_params, *params, *bad_params)))
+
+        shape = (len(states), len(skills))
+        present = np.asarray([[(state, skill) in counts for skill in skills] for state in states],
+                             dtype=bool).reshape(shape)
+        count_matrix = np.asarray([[counts.get((state, skill), 0) for skill in skills] for state in states],
+                                  dtype=float).reshape(shape)
+        denominators = np.asarray([totals.get(state) or 0 for state in states], dtype=float)
+        proportion = np.divide(count_matrix, denominators[:, None], out=np.zeros(shape),
+                               where=denominators[:, None] > 0) * 100
+        return count_matrix, denominators, proportion, present
@@ -0,0 +1,128 @@
+"""
+Single-flight coalescing of identical computations.
+
+When a shared link sends many sessions to the same chart at once, only one
+call computes each figure and the others wait for its result:
+
+- within a process, concurrent calls with the same key share one call;
+- across processes (gunicorn workers, background callback jobs), when
+  SINGLEFLIGHT_DIR is set, the computing call holds an flock on
+  DIR/<key>.lock and leaves its result in DIR/<key>.json for
+  SINGLEFLIGHT_TTL seconds. A process that was waiting on the lock reads
+  that result instead of computing it again.
+
+Files older than the TTL are pruned; at worst a pruned lock lets a key be
+computed twice, never wrongly.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+SINGLEFLIGHT_DIR = os.environ.get("SINGLEFLIGHT_DIR", "")
+SINGLEFLIGHT_TTL = float(os.environ.get("SINGLEFLIGHT_TTL", 30))
+
+
+class Flight:
+    """One in-progress call; waiters block on done."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    do(key, fn) runs fn once per key among concurrent callers and returns
+    (result, shared): shared is True for callers that got another call's
+    result. An exception from fn is raised in every waiting caller.
+    dumps/loads convert results to and from text for the cross-process store.
+    """
+
+    def __init__(self, store_dir=SINGLEFLIGHT_DIR, ttl=SINGLEFLIGHT_TTL, dumps=json.dumps, loads=json.loads):
+        self.store_dir = store_dir
+        self.ttl = ttl
+        self.dumps = dumps
+        self.loads = loads
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._pruned = 0.0
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                self.shared += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result, shared = self._run(key, fn)
+            return flight.result, shared
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _run(self, key, fn):
+        if not self.store_dir:
+            return fn(), False
+        os.makedirs(self.store_dir, exist_ok=True)
+        path = os.path.join(self.store_dir, hashlib.sha1(repr(key).encode()).hexdigest()[:20])
+        with open(path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                os.utime(path + ".lock")    # in use: keep it from being pruned
+                text = self._read(path + ".json")
+                if text is not None:
+                    with self._lock:
+                        self.shared += 1
+                    return self.loads(text), True
+                result = fn()
+                self._write(path + ".json", self.dumps(result))
+                return result, False
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self, path):
+        try:
+            if time.time() - os.stat(path).st_mtime > self.ttl:
+                return None
+            with open(path) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, path, text):
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=self.store_dir)
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+        now = time.time()
+        if now - self._pruned > self.ttl:
+            self._pruned = now
+            self.prune(now)
+
+    def prune(self, now=None):
+        """Remove results and locks older than the TTL."""
+        now = now or time.time()
+        for entry in os.scandir(self.store_dir):
+            try:
+                if now - entry.stat().st_mtime > self.ttl:
+                    os.remove(entry.path)
+            except OSError:
+                pass
@@ -0,0 +1,287 @@
+"""
+Binary columnar snapshots of the dashboard CSVs.
+
+Each CSV is parsed once and written as one uncompressed .npy file per column
+(string columns as categorical codes + categories) plus a manifest recording
+the source file's size, mtime and SHA-1. Later loads read the snapshot as long
+as the source is unchanged and rebuild it otherwise.
+
+The indexes derived from the tables (see dataset.py) are stored per data
+version in <dir>/<version>/: their larger numeric arrays as .npy files that
+workers memory-map, the rest pickled. Every worker on a host then shares one
+copy of them, as it does the columns.
+
+Prebuild during deploy with:
+
+    python snapshot.py build
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", ".snapshots")
+
+# The CSVs read by Oct9P2.py
+TABLES = [
+    "DensityMapDataV3.csv",
+    "TopAISkillsChartData_CareerArea.csv",
+    "TopAICareerDataV2_with_other.csv",
+    "CareerAreaIntensity.csv",
+]
+
+MANIFEST = "manifest.json"
+
+# Index arrays at least this large are memory-mapped; smaller ones would each take a page or more
+INDEX_MMAP_MIN_BYTES = int(os.environ.get("INDEX_MMAP_MIN_BYTES", 64 * 1024))
+INDEX_STRUCTURE = "indexes.pkl"
+# Index store directories: <data version>/
+index_store_pattern = re.compile(r"^[0-9a-f]{12}$")
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def snapshot_path(path, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, os.path.basename(path) + ".cols")
+
+
+def read_manifest(path, snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_path(path, snapshot_dir), MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(path, manifest):
+    """True when the source CSV is the one the snapshot was built from."""
+    if manifest is None:
+        return False
+    st = os.stat(path)
+    if st.st_size != manifest["size"]:
+        return False
+    if st.st_mtime_ns == manifest["mtime_ns"]:
+        return True
+    # Same size, new mtime (e.g. copied during deploy): fall back to the content hash
+    return file_sha1(path) == manifest["sha1"]
+
+
+def remember_mtime(path, manifest, snapshot_dir=SNAPSHOT_DIR):
+    """After a hash match, record the new mtime so the next load skips hashing."""
+    mtime_ns = os.stat(path).st_mtime_ns
+    if manifest["mtime_ns"] == mtime_ns:
+        return
+    manifest["mtime_ns"] = mtime_ns
+    try:
+        with open(os.path.join(snapshot_path(path, snapshot_dir), MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+    except OSError:
+        pass
+
+
+def build_snapshot(path, snapshot_dir=SNAPSHOT_DIR):
+    """Parse the CSV at path and write its snapshot. Returns the parsed DataFrame."""
+    st = os.stat(path)
+    df = pd.read_csv(path)
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=snapshot_dir)
+    os.chmod(tmp, 0o755)
+    columns = []
+    for i, name in enumerate(df.columns):
+        col = df[name]
+        if pd.api.types.is_numeric_dtype(col) or pd.api.types.is_bool_dtype(col):
+            np.save(os.path.join(tmp, f"{i}.npy"), col.to_numpy())
+            columns.append({"name": name, "kind": "numeric"})
+        else:
+            codes, categories = pd.factorize(col, sort=True)
+            # Store codes in the width pandas itself picks, so loading can use them without a copy
+            codes = pd.Categorical.from_codes(codes, categories=categories).codes
+            np.save(os.path.join(tmp, f"{i}.codes.npy"), codes)
+            np.save(os.path.join(tmp, f"{i}.categories.npy"), np.asarray(categories, dtype=str))
+            columns.append({"name": name, "kind": "categorical"})
+
+    manifest = {
+        "source": os.path.basename(path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha1": file_sha1(path),
+        "rows": len(df),
+        "columns": columns,
+    }
+    with open(os.path.join(tmp, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap the finished directory in; a concurrent builder may have beaten us to it
+    target = snapshot_path(path, snapshot_dir)
+    old = target + f".old-{os.getpid()}"
+    if os.path.exists(target):
+        os.replace(target, old)
+    try:
+        os.replace(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+    return df
+
+
+def read_snapshot(path, manifest, snapshot_dir=SNAPSHOT_DIR, mmap_mode=None):
+    directory = snapshot_path(path, snapshot_dir)
+    data = {}
+    for i, column in enumerate(manifest["columns"]):
+        if column["kind"] == "numeric":
+            data[column["name"]] = np.load(os.path.join(directory, f"{i}.npy"), mmap_mode=mmap_mode)
+        else:
+            codes = np.load(os.path.join(directory, f"{i}.codes.npy"), mmap_mode=mmap_mode)
+            categories = np.load(os.path.join(directory, f"{i}.categories.npy"))
+            data[column["name"]] = pd.Categorical.from_codes(codes, categories=categories)
+    return pd.DataFrame(data, copy=False)
+
+
+def load_table(path, snapshot_dir=SNAPSHOT_DIR, mmap=False):
+    """
+    Load a CSV as a typed DataFrame (string columns categorical), from its
+    snapshot when the source is unchanged, rebuilding the snapshot otherwise.
+
+    With mmap=True the numeric columns and categorical codes are read-only
+    memory maps of the snapshot files, so every process on the host that loads
+    the same snapshot shares one copy of those pages.
+    """
+    mmap_mode = "r" if mmap else None
+    manifest = read_manifest(path, snapshot_dir)
+    if is_fresh(path, manifest):
+        remember_mtime(path, manifest, snapshot_dir)
+        return read_snapshot(path, manifest, snapshot_dir, mmap_mode)
+    try:
+        build_snapshot(path, snapshot_dir)
+    except OSError:
+        # Read-only checkout: just parse the CSV
+        return read_csv_typed(path)
+    return read_snapshot(path, read_manifest(path, snapshot_dir), snapshot_dir, mmap_mode)
+
+
+def read_csv_typed(path):
+    df = pd.read_csv(path)
+    for name in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[name]):
+            df[name] = df[name].astype("category")
+    return df
+
+
+# =========================
+# Derived index store
+# =========================
+class StoredArray:
+    """Stands in for an index array saved as <number>.npy beside the pickled index structure."""
+
+    def __init__(self, number):
+        self.number = number
+
+
+def index_store_path(version, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, version)
+
+
+def split_arrays(obj, arrays):
+    """obj with its large numeric arrays appended to arrays and replaced by StoredArray."""
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in "biuf" and obj.nbytes >= INDEX_MMAP_MIN_BYTES:
+        arrays.append(obj)
+        return StoredArray(len(arrays) - 1)
+    if isinstance(obj, dict):
+        return {key: split_arrays(value, arrays) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(split_arrays(value, arrays) for value in obj)
+    return obj
+
+
+def join_arrays(obj, directory, mmap_mode):
+    if isinstance(obj, StoredArray):
+        return np.load(os.path.join(directory, f"{obj.number}.npy"), mmap_mode=mmap_mode)
+    if isinstance(obj, dict):
+        return {key: join_arrays(value, directory, mmap_mode) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(join_arrays(value, directory, mmap_mode) for value in obj)
+    return obj
+
+
+def write_index_store(version, indexes, snapshot_dir=SNAPSHOT_DIR):
+    """Save a data version's indexes (unless already saved) and drop other versions' stores."""
+    target = index_store_path(version, snapshot_dir)
+    if not os.path.exists(target):
+        os.makedirs(snapshot_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=snapshot_dir)
+        os.chmod(tmp, 0o755)
+        arrays = []
+        structure = split_arrays(indexes, arrays)
+        for number, array in enumerate(arrays):
+            np.save(os.path.join(tmp, f"{number}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(tmp, INDEX_STRUCTURE), "wb") as f:
+            pickle.dump(structure, f, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            os.replace(tmp, target)
+        except OSError:
+            # A concurrent builder got there first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    # Workers still on an older version mapped its arrays when they loaded it, and their
+    # mappings outlive the files, so the stores of other versions can go
+    for entry in os.scandir(snapshot_dir):
+        if index_store_pattern.match(entry.name) and entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+    return target
+
+
+def read_index_store(version, snapshot_dir=SNAPSHOT_DIR, mmap_mode="r"):
+    """A data version's stored indexes with their large arrays memory-mapped, or None if not stored."""
+    directory = index_store_path(version, snapshot_dir)
+    try:
+        with open(os.path.join(directory, INDEX_STRUCTURE), "rb") as f:
+            structure = pickle.load(f)
+        return join_arrays(structure, directory, mmap_mode)
+    except (OSError, ValueError, EOFError, AttributeError, pickle.UnpicklingError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build columnar snapshots of the dashboard CSVs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="(re)build snapshots for stale or missing tables")
+    build.add_argument("paths", nargs="*", default=TABLES)
+    build.add_argument("--dir", default=SNAPSHOT_DIR, help="snapshot directory (default: %(default)s)")
+    build.add_argument("--force", action="store_true", help="rebuild even if the snapshot is fresh")
+    build.add_argument("--no-indexes", action="store_true", help="skip the derived index store")
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        if not args.force and is_fresh(path, read_manifest(path, args.dir)):
+            print(f"{path}: fresh")
+            continue
+        df = build_snapshot(path, args.dir)
+        print(f"{path}: built ({len(df)} rows) -> {snapshot_path(path, args.dir)}")
+
+    if not args.no_indexes:
+        from dataset import dataset_version, load_dataset
+
+        if args.force:
+            shutil.rmtree(index_store_path(dataset_version(), args.dir), ignore_errors=True)
+        dataset = load_dataset(mmap=True, snapshot_dir=args.dir)
+        print(f"indexes: {index_store_path(dataset.version, args.dir)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The app's modules live at the repository root, next to the data files they read
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
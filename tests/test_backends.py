@@ -0,0 +1,89 @@
+"""
+The memory and SQLite query backends answer every chart question the same
+way over the bundled CSVs.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from conftest import root
+from dataset import load_dataset, name_key, national
+
+
+@pytest.fixture(scope="module")
+def backends(tmp_path_factory):
+    snapshot_dir = str(tmp_path_factory.mktemp("snapshots"))
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        yield (load_dataset(backend="memory", snapshot_dir=snapshot_dir),
+               load_dataset(backend="sqlite", snapshot_dir=snapshot_dir))
+    finally:
+        os.chdir(cwd)
+
+
+def assert_same(a, b):
+    np.testing.assert_array_equal(np.asarray(a, dtype=object), np.asarray(b, dtype=object))
+
+
+def test_options(backends):
+    memory, sqlite = backends
+    for name in ("years", "density_levels", "career_states", "skills_states", "skills_career_areas"):
+        assert_same(memory.options[name], sqlite.options[name])
+
+
+def test_density(backends):
+    memory, sqlite = backends
+    years = [int(y) for y in memory.options["years"]]
+    for start, end in [(years[0], years[-1])] + [(y, y) for y in years] + [(years[-1] + 1, years[-1] + 5)]:
+        names, codes, ai_jobs, all_jobs = memory.queries.density_totals(start, end)
+        sql_names, sql_codes, sql_ai_jobs, sql_all_jobs = sqlite.queries.density_totals(start, end)
+        assert_same(names, sql_names)
+        assert_same(codes, sql_codes)
+        np.testing.assert_allclose(ai_jobs, sql_ai_jobs)
+        np.testing.assert_allclose(all_jobs, sql_all_jobs)
+    trends, sql_trends = memory.density_trends["state"], sqlite.density_trends["state"]
+    for key in ("names", "codes"):
+        assert_same(trends[key], sql_trends[key])
+    for key in ("slope", "latest", "forecast"):
+        np.testing.assert_allclose(trends[key], sql_trends[key])
+
+
+@pytest.mark.parametrize("metric", ["share", "intensity"])
+def test_career(backends, metric):
+    memory, sqlite = backends
+    states = memory.options["career_states"] + [national, "Nowhere"]
+    for state in states:
+        top = memory.queries.career_top(state, metric, n=None)
+        sql_top = sqlite.queries.career_top(state, metric, n=None)
+        # Missing career area names are NaN in pandas and None from SQL
+        assert_same([name_key(a) for a in top.iloc[:, 0]], [name_key(a) for a in sql_top.iloc[:, 0]])
+        np.testing.assert_allclose(top.iloc[:, 1], sql_top.iloc[:, 1])
+        areas = list(top.iloc[:, 0])
+        np.testing.assert_allclose(memory.queries.career_matrix(states, metric, areas),
+                                   sqlite.queries.career_matrix(states, metric, areas))
+
+
+def test_skills(backends):
+    memory, sqlite = backends
+    areas = memory.options["skills_career_areas"]
+    states = memory.options["skills_states"] + [national, "Nowhere"]
+    selections = [["ALL"], [], areas[:3], ["not an area", areas[-1]]] + [[area] for area in areas]
+    for selection in selections:
+        for state in states:
+            top = memory.queries.skills_top(state, selection, n=None)
+            sql_top = sqlite.queries.skills_top(state, selection, n=None)
+            assert (top is None) == (sql_top is None)
+            if top is not None:
+                assert_same(top[0], sql_top[0])
+                np.testing.assert_allclose(top[1], sql_top[1])
+                assert top[2] == pytest.approx(sql_top[2])
+                np.testing.assert_allclose(top[3], sql_top[3])
+
+        skills = list(memory.queries.skills_top(national, ["ALL"], n=None)[0])
+        matrix = memory.queries.skills_matrix(states, selection, skills)
+        sql_matrix = sqlite.queries.skills_matrix(states, selection, skills)
+        for a, b in zip(matrix, sql_matrix):
+            np.testing.assert_allclose(a, b)
+
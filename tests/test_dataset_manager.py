@@ -0,0 +1,46 @@
+"""
+DatasetManager keeps serving the current version when a new one fails to
+load, and loads it again once the retry delay has passed.
+"""
+from types import SimpleNamespace
+
+import dataset
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_failed_version_is_retried(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dataset.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(dataset, "dataset_version", lambda: "new")
+    outcomes = [SimpleNamespace(version="old"), OSError("half-written"), OSError("still rebuilding"),
+                SimpleNamespace(version="new")]
+
+    def loader():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    manager = dataset.DatasetManager(loader, poll_seconds=0, retry_seconds=10, max_retry_seconds=15)
+    swapped = []
+    manager.on_swap(swapped.append)
+
+    assert not manager.check()              # first failure
+    assert not manager.check()              # waiting 10s
+    clock.now += 10
+    assert not manager.check()              # second failure
+    assert manager.retry_delay(2) == 15     # doubled, capped
+    clock.now += 14
+    assert not manager.check()
+    clock.now += 1
+    assert manager.check()
+    assert manager.current.version == "new"
+    assert [d.version for d in swapped] == ["new"]
+    assert outcomes == []
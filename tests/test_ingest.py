@@ -0,0 +1,39 @@
+"""
+Folding a batch into the ingested tables gives the same tables as ingesting
+everything at once.
+"""
+import numpy as np
+import pandas as pd
+
+import ingest
+
+
+def write_postings(path, rng, states, years, rows):
+    areas = ["Engineering", "Finance", "Health Care", "Sales", ""]
+    skills = [f"Skill {i}" for i in range(15)]
+    pd.DataFrame({
+        "state_name": rng.choice(states, rows),
+        "year": rng.choice(years, rows),
+        "lot_career_area_name": rng.choice(areas, rows),
+        "skills_name": [";".join(rng.choice(skills, rng.integers(0, 5), replace=False)) for _ in range(rows)],
+        "is_ai": rng.choice(["1", "0"], rows, p=[0.4, 0.6]),
+    }).to_csv(path, index=False)
+
+
+def test_incremental_ingest(tmp_path):
+    rng = np.random.default_rng(0)
+    base, batch, full = tmp_path / "base.csv", tmp_path / "batch.csv", tmp_path / "full.csv"
+    write_postings(base, rng, ["Ohio", "Texas", "Utah", "Iowa"], [2020, 2021, 2022], 2000)
+    # The batch touches some states and years, adds a state and a year, and leaves the rest alone
+    write_postings(batch, rng, ["Texas", "Vermont"], [2022, 2023], 300)
+    with open(full, "w") as f:
+        f.write(base.read_text())
+        f.write(batch.read_text().split("\n", 1)[1])
+
+    base_counts = ingest.count_file(str(base), workers=1)
+    batch_counts = ingest.count_file(str(batch), workers=1)
+    updated = ingest.update_tables(ingest.build_tables(base_counts),
+                                   ingest.merge_counts(base_counts, batch_counts), batch_counts)
+    rebuilt = ingest.build_tables(ingest.count_file(str(full), workers=1))
+    for name in ingest.OUTPUTS:
+        pd.testing.assert_frame_equal(updated[name], rebuilt[name], check_dtype=False)